@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Subject, Course, Module
+from .search import get_backend
 
 
 @admin.register(Subject)
@@ -22,4 +23,9 @@ class CourseAdmin(admin.ModelAdmin):
     # This means, when editing a course, admins can also add, edit, or delete associated modules without
     # navigating away.
 
-
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of icontains scans over title/overview.
+        if not search_term:
+            return queryset, False
+        course_ids = get_backend().course_ids(search_term, limit=1000)
+        return queryset.filter(pk__in=course_ids), False
@@ -1,4 +1,9 @@
-from rest_framework.pagination import PageNumberPagination
+from collections import OrderedDict
+from django.core.cache import cache
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from courses.caching import get_version
+from educa.db import PRIMARY
 
 
 
@@ -6,4 +11,91 @@ class StandardPagination(PageNumberPagination):
     page_size = 10      # Determine the default page size (the no. of items returned per page) when
     # no page size is provided in the request
     page_size_query_param = 'page_size'     # Defines the name for the query parameter to use for the page size
-    max_page_size = 50      # Indicates the maximum requested page size allowed
\ No newline at end of file
+    max_page_size = 50      # Indicates the maximum requested page size allowed
+
+
+# Cursor (keyset) pagination
+# Page numbers need a COUNT(*) and an OFFSET scan that grows with the page number, and the pages
+# shift when courses are added while a client walks through them. A cursor encodes the position
+# of the last row instead ("created before X"), so every page is an indexed range scan and the
+# 'next' links stay stable.
+class CourseCursorPagination(CursorPagination):
+    ordering = ('-created', '-id')     # newest first, the id breaks ties between equal timestamps
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    count_query_param = 'count'
+    count_family = 'catalog:courses'    # cache version family the cached count depends on
+    count_timeout = 60 * 15
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.queryset = queryset
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self):
+        # COUNT(*) is optional in cursor mode (?count=true). It is cached, and the cache entry is
+        # invalidated together with the catalog entries when courses/subjects change.
+        key = f'api_count:{self.queryset.model._meta.label_lower}'
+        return cache.get_or_set(
+            key, self.queryset.using(PRIMARY).count, self.count_timeout,
+            version=get_version(self.count_family)
+        )
+
+    def get_paginated_response(self, data):
+        content = OrderedDict()
+        if self.request.query_params.get(self.count_query_param) in ('1', 'true'):
+            content['count'] = self.get_count()
+        content['next'] = self.get_next_link()
+        content['previous'] = self.get_previous_link()
+        content['results'] = data
+        return Response(content)
+
+
+class SubjectCursorPagination(CourseCursorPagination):
+    ordering = ('title', 'id')
+    count_family = 'catalog:subjects'
+
+
+class CatalogPagination(StandardPagination):
+    # Page numbers by default (same responses as before). Clients opt in to cursor pagination
+    # with ?pagination=cursor, and then follow the 'next' links (which carry ?cursor=...).
+    cursor_pagination_class = None
+    mode_query_param = 'pagination'
+    cursor_paginator = None
+
+    def use_cursor(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_pagination_class.cursor_query_param in request.query_params
+        )
+
+    def ordering_columns(self, request):
+        # The cursor is built from the ordering fields of the last row of the page: values()
+        # rows must include them even when the serializer doesn't output them (?fields=).
+        if not self.use_cursor(request):
+            return []
+        return [field.lstrip('-') for field in self.cursor_pagination_class.ordering]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.cursor_paginator:
+            return self.cursor_paginator.to_html()
+        return super().to_html()
+
+
+class CoursePagination(CatalogPagination):
+    cursor_pagination_class = CourseCursorPagination
+
+
+class SubjectPagination(CatalogPagination):
+    cursor_pagination_class = SubjectCursorPagination
@@ -1,6 +1,10 @@
-from django.db.models import Count
+import os
+from collections import defaultdict
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
 from rest_framework import serializers
-from courses.models import Subject, Course, Module
+from courses.models import Subject, Course, Module, UploadSession
 
 
 
@@ -12,11 +16,10 @@ class SubjectSerializer(serializers.ModelSerializer):
     # And the field must be included inside the fields of Meta class.
     def get_popular_courses(self,obj):
         # The 'obj' parameter is the model instance currently being serialized. In this case 'subject_instance'
-        courses = obj.courses.annotate(
-            total_students=Count('students')
-        ).order_by('total_students')[:3]
+        # The ranking is precomputed on the subject (most enrolled first) when enrollments change,
+        # so no query is run per subject here.
         return [
-            f'{c.title} ({c.total_students})' for c in courses
+            f"{c['title']} ({c['total_students']})" for c in obj.popular_courses
         ]
 
     class Meta:
@@ -32,7 +35,18 @@ class ModuleSerializer(serializers.ModelSerializer):
 
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    # ModelSerializer taking the names of the fields to output: CourseSerializer(course, fields=['id', 'title'])
+    # (all of Meta.fields when None).
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+
+class CourseSerializer(DynamicFieldsModelSerializer):
     modules = ModuleSerializer(many=True, read_only=True)
     # This 'modules' field that provides serialization for the related Module objects
     # many=True - indicate that you are serializing multiple related objects.
@@ -43,5 +57,143 @@ class CourseSerializer(serializers.ModelSerializer):
         fields = [ 'id', 'subject', 'title', 'slug', 'overview', 'created',
                    'owner', 'modules'
                 ]
+        # Related data that has to be loaded separately: only output with ?fields=...,modules
+        # or ?expand=modules once ?fields= is used (see CourseViewSet).
+        expandable_fields = ['modules']
+
+
+
+# FAST LIST SERIALIZATION (values() rows)
+# Serializing a page of 50 courses loads 50 model instances, plus their modules through the
+# prefetch machinery, only to read a few attributes from each. For the list endpoints the rows
+# are loaded with values() instead (one query for the page, one grouped query per nested list
+# like 'modules') and wrapped in ValuesRow, which has just what the serializer fields read.
+# The JSON is then built by the serializer itself (Serializer.to_representation() of the same
+# serializer class), so every field formats its value exactly as before.
+#
+# Supported fields: model fields and queryset annotations of the same name, method fields
+# reading the model field of their own name (SubjectSerializer.popular_courses), related
+# fields (ids), and nested serializers (many=True) of reverse foreign keys (modules).
+
+class ValuesRow:
+    # Stand-in for a model instance, built from a values() row.
+    def __init__(self, model, values):
+        self.__dict__.update(values)
+        self._meta = model._meta
+        self.pk = values[model._meta.pk.attname]
+
+    def serializable_value(self, field_name):
+        # Related fields read the id (e.g. subject_id) through this, like on a model instance.
+        return getattr(self, self._meta.get_field(field_name).attname)
+
+
+def values_columns(serializer, queryset):
+    # Columns of `queryset` the fields of `serializer` read: {'field_name': 'column'}
+    model = queryset.model
+    columns = [model._meta.pk.attname]
+    for field in serializer._readable_fields:
+        if isinstance(field, serializers.ListSerializer):
+            continue    # nested: loaded by load_values_rows()
+        source = field.field_name if field.source == '*' else field.source
+        if source in queryset.query.annotations:
+            columns.append(source)
+            continue
+        try:
+            columns.append(model._meta.get_field(source).attname)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured(
+                f'{type(serializer).__name__}.{field.field_name} cannot be read from values() rows.'
+            )
+    return list(dict.fromkeys(columns))
+
+
+def values_queryset(serializer, queryset, extra_columns=()):
+    # The queryset to paginate: the same rows, as dicts with the needed columns only.
+    # extra_columns: read by the pagination, not output (e.g. the ordering of a cursor).
+    return queryset.prefetch_related(None).values(
+        *dict.fromkeys([*values_columns(serializer, queryset), *extra_columns])
+    )
+
+
+def load_values_rows(serializer, model, rows):
+    """
+    Wraps the values() `rows` in ValuesRow objects and loads the nested lists of `serializer`
+    for all of them with one query each.
+    """
+    rows = [ValuesRow(model, row) for row in rows]
+    for field in serializer._readable_fields:
+        if not isinstance(field, serializers.ListSerializer):
+            continue
+        relation = model._meta.get_field(field.source)      # e.g. Course.modules
+        foreign_key = relation.field.attname                 # e.g. Module.course_id
+        related = relation.related_model.objects.filter(
+            **{f'{foreign_key}__in': [row.pk for row in rows]}
+        )
+        related = related.values(*values_columns(field.child, related), foreign_key)
+        groups = defaultdict(list)
+        for child in load_values_rows(field.child, relation.related_model, related):
+            groups[getattr(child, foreign_key)].append(child)
+        for row in rows:
+            setattr(row, field.source, groups[row.pk])
+    return rows
+
+
+def serialize_values_rows(serializer, model, rows):
+    # Same output as ListSerializer(instances).data, from values() rows.
+    return [serializer.to_representation(row) for row in load_values_rows(serializer, model, rows)]
+
+
+
+class EnrollmentSerializer(serializers.Serializer):
+    # Plain ids instead of PrimaryKeyRelatedField: that one would run a query per id,
+    # BulkEnrollmentSerializer checks all of them at once.
+    user = serializers.IntegerField(min_value=1)
+    course = serializers.IntegerField(min_value=1)
+
+
+
+class BulkEnrollmentSerializer(serializers.Serializer):
+    enrollments = EnrollmentSerializer(many=True, allow_empty=False, max_length=10000)
+
+    def validate_enrollments(self, enrollments):
+        user_ids = {e['user'] for e in enrollments}
+        course_ids = {e['course'] for e in enrollments}
+        unknown_users = user_ids - set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        unknown_courses = course_ids - set(Course.objects.filter(pk__in=course_ids).values_list('pk', flat=True))
+        errors = []
+        if unknown_users:
+            errors.append(f'Unknown users: {sorted(unknown_users)}')
+        if unknown_courses:
+            errors.append(f'Unknown courses: {sorted(unknown_courses)}')
+        if errors:
+            raise serializers.ValidationError(errors)
+        return enrollments
+
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    complete = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'module', 'filename', 'size', 'offset', 'complete', 'created']
+        extra_kwargs = {'module': {'allow_null': False, 'required': True}}
+        read_only_fields = ['id', 'offset', 'created']
+
+    def validate_filename(self, filename):
+        return os.path.basename(filename)
+
+    def validate_size(self, size):
+        if not 0 < size <= settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'The size must be between 1 and {settings.UPLOAD_MAX_SIZE} bytes.'
+            )
+        return size
+
+
 
+class UploadCompleteSerializer(serializers.Serializer):
+    # The item (File or Image) to create with the uploaded file (added to the module of the session).
+    type = serializers.ChoiceField(choices=['file', 'image'])
+    title = serializers.CharField(max_length=250)
 
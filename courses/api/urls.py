@@ -37,5 +37,14 @@ urlpatterns = [
     path(
         'courses/<pk>/enroll/', views.CourseEnrollView.as_view(), name='course_enroll'
     ),
+    path(
+        'enrollments/', views.BulkEnrollView.as_view(), name='bulk_enroll'
+    ),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('uploads/', views.UploadSessionCreateView.as_view(), name='upload_create'),
+    path('uploads/<uuid:pk>/', views.UploadSessionView.as_view(), name='upload'),
+    path(
+        'uploads/<uuid:pk>/complete/', views.UploadCompleteView.as_view(), name='upload_complete'
+    ),
 
 ]
\ No newline at end of file
@@ -1,25 +1,236 @@
-from django.db.models import Count
-from django.shortcuts import get_object_or_404
+import hashlib
+import os
+import re
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Max, Prefetch, Q, Sum
+from django.http import Http404
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import generics
-from rest_framework import viewsets
+from rest_framework import status
+from rest_framework import serializers, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from courses.api.pagination import StandardPagination
-from .serializers import SubjectSerializer, CourseSerializer
-from courses.models import Subject, Course
+from courses.export import export_response
+from courses.api.pagination import CoursePagination, StandardPagination, SubjectPagination
+from courses.search import get_backend
+from courses.storage import LocalFile
+from .serializers import (
+    BulkEnrollmentSerializer, SubjectSerializer, CourseSerializer, UploadCompleteSerializer,
+    UploadSessionSerializer, serialize_values_rows, values_queryset
+)
+from courses.models import Content, Subject, Course, File, Image, Module, UploadSession
 
 
+# ASYNC READ ENDPOINTS
+# DRF views are synchronous. This mixin makes list() and retrieve() coroutines: under ASGI
+# they run on the event loop, the object(s) are loaded with the async ORM and the worker can
+# serve other requests meanwhile. Authentication, permissions and pagination are still the
+# (synchronous) DRF code: they run in a worker thread, like the other actions of the viewset.
+class AsyncReadOnlyMixin:
+    # list() builds the JSON from values() rows (see courses/api/serializers.py)
+    values_list = False
 
-class CourseViewSet(viewsets.ReadOnlyModelViewSet):
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        # dispatch() returns a coroutine: let Django know the view is async.
+        return markcoroutinefunction(super().as_view(actions, **initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        # APIView.dispatch(), awaiting the handler
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            # authentication (session and user queries), permissions, throttling
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            if iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.values_list:
+            return await self.list_values(queryset)
+        # The paginator loads the page (and its prefetched relations) as a list, so the
+        # serializer doesn't query the database.
+        page = await sync_to_async(self.paginate_queryset)(queryset)
+        if page is None:
+            data = self.get_serializer([obj async for obj in queryset], many=True).data
+            return Response(data)
+        data = self.get_serializer(page, many=True).data
+        return await sync_to_async(self.get_paginated_response)(data)   # may count (cached)
+
+    async def list_values(self, queryset):
+        # Same response as above, without creating model instances.
+        serializer = self.get_serializer(many=True).child
+        ordering_columns = getattr(self.paginator, 'ordering_columns', None)
+        rows = values_queryset(
+            serializer, queryset, ordering_columns(self.request) if ordering_columns else ()
+        )
+        page = await sync_to_async(self.paginate_queryset)(rows)
+        data = await sync_to_async(serialize_values_rows)(
+            serializer, queryset.model, [row async for row in rows] if page is None else page
+        )
+        if page is None:
+            return Response(data)
+        return await sync_to_async(self.get_paginated_response)(data)
+
+    async def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            instance = await aget_object_or_404(
+                self.filter_queryset(self.get_queryset()),
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        except (TypeError, ValueError, ValidationError):
+            raise Http404     # e.g. /api/courses/abc/, like GenericAPIView.get_object()
+        self.check_object_permissions(request, instance)
+        return Response(self.get_serializer(instance).data)
+
+
+# CONDITIONAL GET (ETag / Last-Modified)
+# Clients poll the catalog. Before loading and serializing anything, one query reads when the
+# resource last changed (the `updated` field of the model, see Course.updated/Subject.updated):
+# - detail: the `updated` value of the object -> ETag and Last-Modified
+# - list: number of objects and latest `updated` -> ETag only (a deletion doesn't move the
+#   latest timestamp, so Last-Modified would not be reliable for lists)
+# If the client already has this version (If-None-Match / If-Modified-Since), the answer is a
+# 304 without a body.
+class ConditionalReadMixin:
+    updated_field = 'updated'
+
+    def get_state_queryset(self):
+        # the plain table, without the annotations/prefetches of the queryset
+        return self.filter_queryset(self.queryset.model._default_manager.order_by())
+
+    def get_etag(self, *parts):
+        # The renderer is part of it: JSON and the browsable API are different representations.
+        state = ':'.join(str(part) for part in (*parts, self.request.accepted_renderer.format))
+        return quote_etag(hashlib.md5(state.encode()).hexdigest())
+
+    async def conditional(self, request, handler, etag, last_modified=None, *args, **kwargs):
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    async def list(self, request, *args, **kwargs):
+        state = await self.get_state_queryset().aaggregate(
+            count=Count('pk'), updated=Max(self.updated_field)
+        )
+        updated = state['updated'].timestamp() if state['updated'] else 0
+        etag = self.get_etag('list', state['count'], updated, request.get_full_path())
+        return await self.conditional(request, super().list, etag, None, *args, **kwargs)
+
+    async def retrieve(self, request, *args, **kwargs):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            updated = await self.get_state_queryset().filter(
+                **{self.lookup_field: lookup}
+            ).values_list(self.updated_field, flat=True).afirst()
+        except (TypeError, ValueError, ValidationError):
+            updated = None
+        if updated is None:
+            return await super().retrieve(request, *args, **kwargs)     # 404
+        etag = self.get_etag('detail', lookup, updated.timestamp())
+        return await self.conditional(
+            request, super().retrieve, etag, int(updated.timestamp()), *args, **kwargs
+        )
+
+
+class CourseViewSet(ConditionalReadMixin, AsyncReadOnlyMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Course.objects.prefetch_related('modules')
     serializer_class = CourseSerializer
-    pagination_class = StandardPagination
+    pagination_class = CoursePagination     # page numbers, or cursor pagination with ?pagination=cursor
+    values_list = True
+
+    # SPARSE FIELDSETS
+    # ?fields=id,title outputs only those fields, and only loads their columns: a course picker
+    # doesn't pay for the overview text nor for the module rows. The modules are loaded when
+    # asked for, with ?fields=...,modules or ?expand=modules. Without ?fields= the output is
+    # the complete course, modules included, as before.
+    def get_requested_fields(self):
+        if 'fields' not in self.request.query_params:
+            return None
+        meta = self.serializer_class.Meta
+        fields = {name for name in self.request.query_params['fields'].split(',') if name}
+        if not fields:
+            # ?fields= (or ?fields=,): empty objects, for the price of the whole list
+            raise serializers.ValidationError({'fields': 'Expected at least one field.'})
+        fields |= set(self.request.query_params.get('expand', '').split(',')) & set(meta.expandable_fields)
+        unknown = fields - set(meta.fields)
+        if unknown:
+            raise serializers.ValidationError({'fields': f'Unknown fields: {", ".join(sorted(unknown))}'})
+        return [name for name in meta.fields if name in fields]     # in the default order
+
+    def get_queryset(self):
+        fields = self.get_requested_fields()
+        if fields is None:
+            return super().get_queryset()
+        columns = [name for name in fields if name not in self.serializer_class.Meta.expandable_fields]
+        # id and created: the ordering, used by the (cursor) pagination
+        queryset = Course.objects.only('id', 'created', *columns)
+        if 'modules' in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'modules',
+                    queryset=Module.objects.only('id', 'course_id', 'order', 'title', 'description')
+                )
+            )
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
 
+    # EXPORT (staff only), streamed as JSON Lines (see courses/export.py)
+    # GET /api/courses/<pk>/export/ -> one course; GET /api/courses/export/ -> the whole catalog
+    @action(detail=True, methods=['get'], permission_classes=[IsAdminUser])
+    def export(self, request, *args, **kwargs):
+        course = self.get_object()
+        return export_response(
+            request, Course.objects.filter(pk=course.pk), f'course-{course.pk}.jsonl'
+        )
 
-class SubjectViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Subject.objects.annotate(total_courses=Count('courses'))     # The base QuerySet to fetch objects
+    @action(detail=False, methods=['get'], url_path='export', url_name='export-all',
+            permission_classes=[IsAdminUser])
+    def export_all(self, request, *args, **kwargs):
+        return export_response(request, Course.objects.all(), 'catalog.jsonl')
+
+
+class SubjectViewSet(ConditionalReadMixin, AsyncReadOnlyMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Subject.objects.annotate(
+        total_courses=Count('courses')
+    ).order_by('title')     # The base QuerySet to fetch objects
+    # (Meta.ordering is not applied to GROUP BY queries, so the order is explicit for the pagination)
     serializer_class = SubjectSerializer    # Tells the ViewSet how to serializer the data before sending it as JSON.
-    pagination_class = StandardPagination   # Controls how many results per page are returned.
+    pagination_class = SubjectPagination    # Controls how many results per page are returned.
+    values_list = True
 
 
 # class SubjectListView(generics.ListAPIView):
@@ -60,5 +271,173 @@ class CourseEnrollView(APIView):
         return Response({'enrolled':True})
 
 
+# BULK ENROLLMENT (e.g. onboarding a whole cohort with one request)
+# POST {"enrollments": [{"user": 1, "course": 2}, ...]}
+# -> {"attempted": <enrollments inserted>, "existing": <enrollments that already existed>}
+# ("attempted": an enrollment made concurrently by another request is silently skipped.)
+class BulkEnrollView(APIView):
+    permission_classes = [IsAdminUser]     # staff only: it enrolls other users
+
+    def post(self, request, format=None):
+        serializer = BulkEnrollmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        attempted, existing = Course.objects.bulk_enroll(
+            (e['course'], e['user']) for e in serializer.validated_data['enrollments']
+        )
+        return Response({'attempted': attempted, 'existing': existing})
+
+
+# FULL-TEXT SEARCH
+# GET /api/search/?q=django+forms -> ranked hits (courses, modules and texts), paginated.
+# The hits come from the search index (courses/search.py), the base tables are not scanned.
+class SearchView(APIView):
+    permission_classes = [AllowAny]
+    pagination_class = StandardPagination
+
+    @staticmethod
+    def visible_courses(user):
+        # Module and text hits show course contents: only those of the courses the user is
+        # enrolled in or teaches (all of them for staff). Course hits (title and overview, shown
+        # on the public course pages) are returned to everyone.
+        if user.is_staff:
+            return None
+        if not user.is_authenticated:
+            return []
+        return list(
+            Course.objects.filter(Q(students=user) | Q(owner=user)).values_list('pk', flat=True).distinct()
+        )
+
+    def get(self, request, format=None):
+        paginator = self.pagination_class()
+        results = get_backend().search(
+            request.query_params.get('q', ''),
+            courses=self.visible_courses(request.user),
+            public_kinds=('course',),
+        )
+        page = paginator.paginate_queryset(results, request, view=self)
+        return paginator.get_paginated_response(page)
+
+
+# RESUMABLE UPLOADS (files and images of the course contents)
+# 1. POST /api/uploads/ {"module": 1, "filename": "slides.pdf", "size": 52428800}
+#    -> {"id": ..., "offset": 0}. Only the instructor owning the module can upload to it, with
+#    a limited number and total size of unfinished uploads (settings.UPLOAD_MAX_OPEN_*).
+# 2. PUT /api/uploads/<id>/ with the raw bytes of a chunk and
+#    "Content-Range: bytes <start>-<end>/<size>", <start> being the current offset; repeat.
+#    After a network error, GET /api/uploads/<id>/ returns the offset to resume from.
+# 3. POST /api/uploads/<id>/complete/ {"type": "file", "title": "Slides"}
+#    -> creates the File/Image item (stored once per content, see courses/storage.py) and
+#       adds it to the module.
+# The chunks are streamed to disk, a chunk is never held in memory.
+class UploadSessionCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = UploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data['module'].course.owner_id != request.user.id:
+            return Response(
+                {'errors': ['You can only upload to the modules of your courses.']},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        with transaction.atomic():
+            # Locking the user's row serializes the uploads a user starts: a concurrent request
+            # waits here, then counts the session created by this one. (Locking the sessions
+            # themselves would not stop new ones from being inserted.)
+            User.objects.select_for_update().get(pk=request.user.pk)
+            totals = UploadSession.objects.filter(owner=request.user).aggregate(
+                count=Count('pk'), size=Sum('size')
+            )
+            if totals['count'] >= settings.UPLOAD_MAX_OPEN_SESSIONS:
+                return Response(
+                    {'errors': [f'At most {settings.UPLOAD_MAX_OPEN_SESSIONS} unfinished uploads.']},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS
+                )
+            if (totals['size'] or 0) + serializer.validated_data['size'] > settings.UPLOAD_MAX_OPEN_SIZE:
+                return Response(
+                    {'errors': [f'Unfinished uploads are limited to {settings.UPLOAD_MAX_OPEN_SIZE} bytes.']},
+                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                )
+            serializer.save(owner=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionView(APIView):
+    permission_classes = [IsAuthenticated]
+    content_range = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+    read_size = 64 * 1024
+
+    def get(self, request, pk, format=None):
+        session = get_object_or_404(UploadSession, pk=pk, owner=request.user)
+        return Response(UploadSessionSerializer(session).data)
+
+    def put(self, request, pk, format=None):
+        session = get_object_or_404(UploadSession, pk=pk, owner=request.user)
+        match = self.content_range.match(request.headers.get('Content-Range', ''))
+        if not match:
+            return Response(
+                {'errors': ['Expected a "Content-Range: bytes <start>-<end>/<size>" header.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        start, end, size = map(int, match.groups())
+        length = end - start + 1
+        if size != session.size or length <= 0 or end >= size:
+            return Response({'errors': ['Invalid range.']}, status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            return Response(
+                {'errors': [f'Chunks are limited to {settings.UPLOAD_CHUNK_MAX_SIZE} bytes.']},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        if start != session.offset:
+            # e.g. a chunk sent twice: the client resumes from the returned offset
+            return Response(
+                {'errors': ['The chunk must start at the current offset.'], 'offset': session.offset},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        received = 0
+        stream = request.stream     # None without a body
+        os.makedirs(settings.UPLOAD_SESSIONS_DIR, exist_ok=True)
+        with open(session.part_path, 'ab') as part:
+            part.truncate(start)    # drop the rest of a chunk that was interrupted
+            while received < length and stream:
+                data = stream.read(min(self.read_size, length - received))
+                if not data:
+                    break   # connection lost: keep what arrived, the client resumes from there
+                part.write(data)
+                received += len(data)
+        # Only if no other request moved the offset meanwhile.
+        UploadSession.objects.filter(pk=session.pk, offset=start).update(offset=start + received)
+        session.refresh_from_db()
+        return Response(UploadSessionSerializer(session).data)
+
+
+class UploadCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+    models = {'file': File, 'image': Image}
+
+    def post(self, request, pk, format=None):
+        session = get_object_or_404(UploadSession, pk=pk, owner=request.user)
+        serializer = UploadCompleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if not session.complete:
+            return Response(
+                {'errors': ['The upload is not complete.'], 'offset': session.offset},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        module = get_object_or_404(Module, pk=session.module_id, course__owner=request.user)
 
+        with transaction.atomic():
+            item = self.models[data['type']](owner=request.user, title=data['title'])
+            with open(session.part_path, 'rb') as part:
+                # moved into the storage (or dropped, if the same content is already stored)
+                item.file.save(session.filename, LocalFile(part), save=False)
+            item.save()
+            content = Content.objects.create(module=module, item=item)
+            session.delete()
+        return Response(
+            {'content': content.id, 'item': item.id, 'type': data['type'], 'file': item.file.name},
+            status=status.HTTP_201_CREATED
+        )
 
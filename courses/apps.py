@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class CoursesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'courses'
+
+    def ready(self):
+        # import signal handlers
+        from . import signals  # noqa: F401
+        # optional cache warming after 'migrate' (settings.CACHE_WARMUP_ON_MIGRATE)
+        from django.db.models.signals import post_migrate
+        from .catalog import warm_after_migrate
+        post_migrate.connect(warm_after_migrate, sender=self)
@@ -0,0 +1,349 @@
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .api.serializers import CourseSerializer, SubjectSerializer, serialize_values_rows, values_queryset
+from .models import Content, Course, File, Image, Module, Subject, Text, Video
+
+
+# Query/latency benchmark of the catalog, student and API views.
+# Used by 'manage.py benchmark_views' (JSON report, fails when a budget is exceeded)
+# and by the test suite (courses/tests.py) to catch performance regressions.
+# 'manage.py benchmark_servers' compares the throughput of the public read views served
+# through the WSGI and the ASGI application (see throughput() below).
+
+# Maximum number of SQL queries per view, with an empty cache. They don't depend on the
+# size of the catalog: a view that runs one query per course/module/item goes over budget.
+QUERY_BUDGETS = {
+    'course_list': 2,
+    'course_list_subject': 3,
+    'course_detail': 3,
+    'student_course_detail': 10,
+    'module_content_list': 9,
+    # API: +1 for the ETag lookup (courses/api/views.py), the only query when answering 304
+    'api:course-list': 4,
+    'api:course-detail': 3,
+    'api:subject-list': 3,
+    'api:subject-detail': 2,
+}
+
+PASSWORD = 'benchmark'
+
+
+def seed_catalog(subjects=3, courses=5, modules=4, contents=8, students=20):
+    """
+    Creates subjects x courses x modules x contents (mixed text/video/image/file items),
+    all the courses with `students` enrolled students. Returns the objects the views need.
+    """
+    owner = User.objects.create_user('bench-instructor', password=PASSWORD)
+    student = User.objects.create_user('bench-student', password=PASSWORD)
+    others = User.objects.bulk_create(
+        [User(username=f'bench-student-{i}') for i in range(students - 1)]
+    )
+
+    subject_objs = Subject.objects.bulk_create(
+        [Subject(title=f'Benchmark {s}', slug=f'bench-{s}') for s in range(subjects)]
+    )
+    course_objs = []
+    for subject in subject_objs:
+        for c in range(courses):
+            course_objs.append(
+                Course.objects.create(
+                    owner=owner, subject=subject, title=f'{subject.title} course {c}',
+                    slug=f'{subject.slug}-course-{c}', overview='Benchmark course.\n\nOverview.'
+                )
+            )
+    module_objs = Module.objects.bulk_create(
+        [
+            Module(course=course, title=f'Module {m}', description='Benchmark module.')
+            for course in course_objs for m in range(modules)
+        ]
+    )
+
+    item_factories = cycle([
+        lambda i: Text(owner=owner, title=f'Text {i}', content='Lorem ipsum.\n\n' * 20),
+        lambda i: Video(owner=owner, title=f'Video {i}', url='https://www.youtube.com/watch?v=dQw4w9WgXcQ'),
+        lambda i: Image(owner=owner, title=f'Image {i}', file='images/benchmark.png'),
+        lambda i: File(owner=owner, title=f'File {i}', file='files/benchmark.pdf'),
+    ])
+    items = [next(item_factories)(i) for i in range(len(module_objs) * contents)]
+    for item in items:
+        if isinstance(item, Video):
+            item.refresh_embed()    # done by Video.save(), bulk_create() doesn't call it
+    for model in (Text, Video, Image, File):
+        model.objects.bulk_create([item for item in items if isinstance(item, model)])
+    for item in items:
+        # rendered once here, like items saved through the views
+        item.refresh_render(commit=False)
+    for model in (Text, Video, Image, File):
+        model.objects.bulk_update(
+            [item for item in items if isinstance(item, model)], ['rendered', 'rendered_key']
+        )
+    Content.objects.bulk_create(
+        [
+            Content(module=module, item=items[m * contents + i])
+            for m, module in enumerate(module_objs) for i in range(contents)
+        ]
+    )
+
+    Course.objects.filter(pk__in=[c.pk for c in course_objs]).bulk_enroll(
+        (course.pk, user.pk) for course in course_objs for user in [student, *others]
+    )
+    Course.objects.filter(pk__in=[c.pk for c in course_objs]).refresh_counters()
+    return {
+        'owner': owner,
+        'student': student,
+        'subject': subject_objs[0],
+        'course': course_objs[0],
+        'module': module_objs[0],
+    }
+
+
+def clear_catalog():
+    # Deletes what seed_catalog() created (courses, modules, contents and items go with their owner).
+    User.objects.filter(username__startswith='bench-').delete()
+    Subject.objects.filter(slug__startswith='bench-').delete()
+
+
+def get_scenarios(seed):
+    # view name -> (url, user to log in with or None)
+    subject, course, module = seed['subject'], seed['course'], seed['module']
+    return {
+        'course_list': (reverse('course_list'), None),
+        'course_list_subject': (reverse('course_list_subject', args=[subject.slug]), None),
+        'course_detail': (reverse('course_detail', args=[course.slug]), None),
+        'student_course_detail': (
+            reverse('student_course_detail', args=[course.pk]), seed['student']
+        ),
+        'module_content_list': (reverse('module_content_list', args=[module.pk]), seed['owner']),
+        'api:course-list': (reverse('api:course-list'), None),
+        'api:course-detail': (reverse('api:course-detail', args=[course.pk]), None),
+        'api:subject-list': (reverse('api:subject-list'), None),
+        'api:subject-detail': (reverse('api:subject-detail', args=[subject.pk]), None),
+    }
+
+
+def measure(url, user=None, repeat=5, warm_cache=False):
+    """
+    Requests `url` `repeat` times and returns the query count, the median wall time and the
+    response size. Unless warm_cache is set, the cache is cleared before every request, so the
+    numbers are the ones of the uncached path.
+    """
+    client = Client()
+    if user:
+        client.force_login(user)
+    client.get(url)     # warm up (template loading, content types cache, ...)
+
+    timings = []
+    for _ in range(repeat):
+        if not warm_cache:
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(url)
+            timings.append(time.perf_counter() - start)
+    return {
+        'url': url,
+        'status': response.status_code,
+        'queries': len(queries.captured_queries),
+        'time_ms': round(statistics.median(timings) * 1000, 2),
+        'bytes': len(response.content),
+    }
+
+
+def run(repeat=5, warm_cache=False, budgets=None, **catalog):
+    seed = seed_catalog(**catalog)
+    budgets = QUERY_BUDGETS if budgets is None else budgets
+    results = {}
+    for name, (url, user) in get_scenarios(seed).items():
+        result = measure(url, user, repeat=repeat, warm_cache=warm_cache)
+        result['budget'] = budgets.get(name)
+        result['over_budget'] = result['budget'] is not None and result['queries'] > result['budget']
+        results[name] = result
+    return {
+        'catalog': catalog,
+        'repeat': repeat,
+        'warm_cache': warm_cache,
+        'results': results,
+        'over_budget': [name for name, result in results.items() if result['over_budget']],
+    }
+
+
+def to_json(report):
+    return json.dumps(report, indent=2)
+
+
+# Throughput: WSGI vs ASGI
+# The same URLs are requested `total` times with `concurrency` requests in flight, through
+# the WSGI handler (one thread per in-flight request, like a threaded WSGI server) and through
+# the ASGI handler (one event loop, like a uvicorn worker). The handlers are called directly,
+# without sockets, so the numbers compare the request handling only. The requests need
+# committed data: the database connections are per thread.
+
+def public_urls(seed):
+    # Anonymous read views (the async ones).
+    return [
+        url for name, (url, user) in get_scenarios(seed).items()
+        if user is None
+    ]
+
+
+def wsgi_request(handler, url):
+    parts = urlsplit(url)
+    environ = {'PATH_INFO': parts.path, 'QUERY_STRING': parts.query, 'HTTP_HOST': 'testserver'}
+    setup_testing_defaults(environ)
+    statuses = []
+    body = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    for _ in body:
+        pass
+    body.close()    # sends request_finished (closes the database connection)
+    return int(statuses[0].split()[0])
+
+
+async def asgi_request(handler, url):
+    parts = urlsplit(url)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': parts.path, 'raw_path': parts.path.encode(),
+        'query_string': parts.query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    request_sent = False
+    messages = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.Future()   # the client never disconnects
+
+    async def send(message):
+        messages.append(message)
+
+    await handler(scope, receive, send)
+    return messages[0]['status']
+
+
+def summarize(elapsed, latencies, statuses):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if status != 200),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+
+
+def run_wsgi(urls, total, concurrency):
+    handler = WSGIHandler()
+
+    def timed(url):
+        start = time.perf_counter()
+        status = wsgi_request(handler, url)
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, (urls[i % len(urls)] for i in range(total))))
+    elapsed = time.perf_counter() - start
+    return summarize(elapsed, [r[0] for r in results], [r[1] for r in results])
+
+
+def run_asgi(urls, total, concurrency):
+    handler = ASGIHandler()
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(url):
+            async with semaphore:
+                start = time.perf_counter()
+                status = await asgi_request(handler, url)
+                return time.perf_counter() - start, status
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(timed(urls[i % len(urls)]) for i in range(total)))
+        return time.perf_counter() - start, results
+
+    elapsed, results = asyncio.run(main())
+    return summarize(elapsed, [r[0] for r in results], [r[1] for r in results])
+
+
+def throughput(urls, total=200, concurrency=20):
+    for url in urls:     # warm up (templates, content types, cached catalog entries)
+        wsgi_request(WSGIHandler(), url)
+    wsgi = run_wsgi(urls, total, concurrency)
+    asgi = run_asgi(urls, total, concurrency)
+    return {
+        'urls': urls,
+        'concurrency': concurrency,
+        'wsgi': wsgi,
+        'asgi': asgi,
+        'asgi_vs_wsgi': round(asgi['requests_per_second'] / wsgi['requests_per_second'], 2),
+    }
+
+
+# Serialization: model instances vs values() rows
+# What the list endpoints spend on loading and serializing a page, with the ModelSerializer
+# path (instances + prefetch_related) and with the values() path (courses/api/serializers.py).
+# The two outputs must be identical.
+
+def serialization_paths():
+    # {endpoint: (serializer class, queryset as in the viewset)}
+    return {
+        'api:course-list': (CourseSerializer, Course.objects.prefetch_related('modules')),
+        'api:subject-list': (
+            SubjectSerializer, Subject.objects.annotate(total_courses=Count('courses')).order_by('title')
+        ),
+    }
+
+
+def serialize_instances(serializer_class, queryset):
+    return serializer_class(list(queryset.all()), many=True).data     # .all(): not the cached rows
+
+
+def serialize_values(serializer_class, queryset):
+    serializer = serializer_class(many=True).child
+    return serialize_values_rows(serializer, queryset.model, list(values_queryset(serializer, queryset)))
+
+
+def serialization(repeat=5, page_size=50, **catalog):
+    seed_catalog(**catalog)
+    results = {}
+    for name, (serializer_class, queryset) in serialization_paths().items():
+        queryset = queryset[:page_size]     # a page of the largest size allowed
+        result = {}
+        for path, serialize in (('instances', serialize_instances), ('values', serialize_values)):
+            data = serialize(serializer_class, queryset)    # warm up
+            timings = []
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    serialize(serializer_class, queryset)
+                    timings.append(time.perf_counter() - start)
+            result[path] = {
+                'queries': len(queries.captured_queries) // repeat,
+                'time_ms': round(statistics.median(timings) * 1000, 2),
+            }
+            result[f'{path}_output'] = json.dumps(data, default=str)
+        result['identical'] = result.pop('instances_output') == result.pop('values_output')
+        result['speedup'] = round(result['instances']['time_ms'] / result['values']['time_ms'], 2)
+        results[name] = result
+    return {'catalog': catalog, 'page_size': page_size, 'repeat': repeat, 'results': results}
+
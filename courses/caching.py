@@ -0,0 +1,92 @@
+import time
+from django.core.cache import cache
+
+
+# Version-based invalidation
+# Instead of deleting cached entries (we don't always know every key that depends on a change),
+# each "family" of keys has a version number stored in the cache. Entries are read and written
+# with version=<current family version>, so bumping the version makes all of them unreachable at
+# once; the stale entries simply expire on their own. Because the keys are never stale, the
+# entries themselves can be cached for hours.
+#
+# Families used by the catalog:
+# - 'catalog:subjects'          -> 'all_subjects'
+# - 'catalog:courses'           -> 'all_courses'
+# - 'catalog:subject:<id>'      -> 'subject_<id>_courses'
+#
+# Families used by the student course pages ({% cache %} fragments, the version is part of the key):
+# - 'course:<id>:structure'     -> module navigation of the course
+# - 'module:<id>:contents'      -> rendered contents of the module
+
+VERSION_KEY = 'version:{}'
+
+
+def subject_courses_family(subject_id):
+    return f'catalog:subject:{subject_id}'
+
+
+def course_structure_family(course_id):
+    return f'course:{course_id}:structure'
+
+
+def module_contents_family(module_id):
+    return f'module:{module_id}:contents'
+
+
+def _initial_version():
+    # If a version key is evicted or the cache is flushed, restarting from 1 could make old
+    # entries reachable again. A millisecond timestamp is always bigger than any previous version.
+    return int(time.time() * 1000)
+
+
+def get_version(family):
+    key = VERSION_KEY.format(family)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(*families):
+    """
+    Returns {family: version} for all the given families with a single cache round trip
+    (plus one per family that has no version yet).
+    """
+    keys = {VERSION_KEY.format(family): family for family in families}
+    found = cache.get_many(keys)
+    versions = {keys[key]: version for key, version in found.items()}
+    for family in families:
+        if family not in versions:
+            versions[family] = get_version(family)
+    return versions
+
+
+async def aget_version(family):
+    key = VERSION_KEY.format(family)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, _initial_version(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+async def aget_versions(*families):
+    # Async get_versions(), for the async views.
+    keys = {VERSION_KEY.format(family): family for family in families}
+    found = await cache.aget_many(keys)
+    versions = {keys[key]: version for key, version in found.items()}
+    for family in families:
+        if family not in versions:
+            versions[family] = await aget_version(family)
+    return versions
+
+
+def bump_version(*families):
+    for family in families:
+        key = VERSION_KEY.format(family)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The key doesn't exist (never read, or evicted): any fresh version invalidates.
+            cache.add(key, _initial_version(), timeout=None)
@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import connection
+from django.db.models import Count, F, Sum
+from django.template.loader import render_to_string
+from educa.db import PRIMARY
+from .caching import get_version, module_contents_family, subject_courses_family
+from .models import Course, Module, Subject
+
+
+logger = logging.getLogger(__name__)
+
+
+# Catalog cache entries
+# What CourseListView and the student course pages cache, built in one place so the cache
+# warmer below stores exactly what the views would. Read from the primary database: the
+# entries live for hours (see educa/db.py).
+
+def subjects_queryset():
+    # 'all_subjects': the sidebar, with the number of courses of each subject
+    return Subject.objects.using(PRIMARY).annotate(total_courses=Count('courses'))
+
+
+def courses_queryset():
+    # 'all_courses' / 'subject_<id>_courses'
+    # (total_modules is a counter column on Course, no Count('modules') join needed)
+    # The template shows the subject and the instructor of every course: load them with the
+    # same query (and into the cached objects) instead of two queries per course.
+    return Course.objects.using(PRIMARY).select_related('subject', 'owner')
+
+
+def module_contents_key(module_id, version):
+    # Key of {% cache ... module_contents module.id contents_version %} (students/course/detail.html)
+    return make_template_fragment_key('module_contents', [module_id, version])
+
+
+def render_module_contents(module):
+    return render_to_string(
+        'students/course/contents.html', {'contents': module.contents.using(PRIMARY).with_items()}
+    )
+
+
+# Cache warmer
+# After a deploy or a cache flush, the first visitors would all miss at once. warm() rebuilds
+# the catalog entries and the contents of every module ahead of them, with `workers` threads
+# (each with its own database connection), the most enrolled courses first. Entries that are
+# already cached are skipped unless force=True.
+#
+# A task is (label, key_and_version, build): key_and_version() returns the cache key and
+# version to use, build() the value to store.
+
+def get_tasks():
+    timeout = settings.CATALOG_CACHE_TIMEOUT
+    yield (
+        'all_subjects',
+        lambda: ('all_subjects', get_version('catalog:subjects')),
+        lambda: (list(subjects_queryset()), timeout),
+    )
+    yield (
+        'all_courses',
+        lambda: ('all_courses', get_version('catalog:courses')),
+        lambda: (list(courses_queryset()), timeout),
+    )
+    subjects = Subject.objects.annotate(
+        students=Sum('courses__total_students')
+    ).order_by(F('students').desc(nulls_last=True), 'pk').values_list('pk', flat=True)
+    for subject_id in subjects:
+        yield (
+            f'subject_{subject_id}_courses',
+            lambda s=subject_id: (f'subject_{s}_courses', get_version(subject_courses_family(s))),
+            lambda s=subject_id: (list(courses_queryset().filter(subject_id=s)), timeout),
+        )
+
+    modules = Module.objects.order_by(
+        '-course__total_students', 'course_id', 'order'
+    ).values_list('pk', flat=True)
+    for module_id in modules:
+        yield (
+            f'module_{module_id}_contents',
+            # fragment keys hold the version themselves
+            lambda m=module_id: (module_contents_key(m, get_version(module_contents_family(m))), None),
+            lambda m=module_id: (
+                render_module_contents(Module.objects.get(pk=m)), settings.COURSE_CACHE_TIMEOUT
+            ),
+        )
+
+
+def run_task(task, force=False):
+    label, key_and_version, build = task
+    start = time.perf_counter()
+    key, version = key_and_version()
+    if not force and cache.get(key, version=version) is not None:
+        status = 'cached'
+    else:
+        value, timeout = build()
+        cache.set(key, value, timeout, version=version)
+        status = 'built'
+    return {'entry': label, 'status': status, 'ms': round((time.perf_counter() - start) * 1000, 2)}
+
+
+def warm(workers=4, force=False, progress=None):
+    """
+    Runs all the tasks with at most `workers` at a time, calling progress(result, done) after
+    each one. Returns the results and the timings.
+    """
+    tasks = iter(list(get_tasks()))     # queried here, not from the worker threads
+    lock = threading.Lock()
+    results = []
+    start = time.perf_counter()
+
+    def next_task():
+        with lock:
+            return next(tasks, None)
+
+    def work():
+        while (task := next_task()) is not None:
+            try:
+                result = run_task(task, force=force)
+            except Exception as e:
+                logger.exception('Cache warming failed for %s', task[0])
+                result = {'entry': task[0], 'status': 'failed', 'error': str(e)}
+            with lock:
+                results.append(result)
+                done = len(results)
+            if progress:
+                progress(result, done)
+
+    if workers <= 1:
+        work()
+    else:
+        def thread_work():
+            try:
+                work()
+            finally:
+                connection.close()      # the connection of this thread
+
+        threads = [threading.Thread(target=thread_work) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return {
+        'entries': len(results),
+        'built': sum(1 for r in results if r['status'] == 'built'),
+        'cached': sum(1 for r in results if r['status'] == 'cached'),
+        'failed': sum(1 for r in results if r['status'] == 'failed'),
+        'seconds': round(time.perf_counter() - start, 3),
+        'results': results,
+    }
+
+
+def warm_after_migrate(sender, **kwargs):
+    # post_migrate hook (see CoursesConfig.ready()), enabled with CACHE_WARMUP_ON_MIGRATE:
+    # the container runs 'migrate' before starting the server.
+    if not settings.CACHE_WARMUP_ON_MIGRATE:
+        return
+    try:
+        report = warm(workers=settings.CACHE_WARMUP_WORKERS)
+    except Exception:
+        # e.g. Redis not reachable yet: don't fail the migration for that.
+        logger.exception('Cache warming after migrate failed')
+        return
+    logger.info(
+        'Cache warmed after migrate: %s entries built, %s already cached in %ss',
+        report['built'], report['cached'], report['seconds']
+    )
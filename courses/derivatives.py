@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image as PILImage, ImageOps
+from .models import Image
+from .storage import blob_storage
+
+
+logger = logging.getLogger(__name__)
+
+
+# Responsive variants of Image items
+# Saving an Image queues the generation of smaller versions of it (settings.IMAGE_DERIVATIVE_WIDTHS,
+# each in WebP and in the original format) in a pool of background threads, so the request
+# doesn't wait for Pillow. The files are written once per original under
+#     derivatives/<digest of the original>/<width>.<webp|jpeg|png>
+# (items sharing a blob share them too) and listed in Image.derivatives; the item is then
+# rendered again with a srcset. Until then, the template falls back to the original file.
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_DERIVATIVE_WORKERS, thread_name_prefix='derivatives'
+        )
+    return _executor
+
+
+def queue_derivatives(image_id):
+    get_executor().submit(run_in_worker, image_id)
+
+
+def run_in_worker(image_id):
+    try:
+        generate_derivatives(image_id)
+    except Exception:
+        logger.exception('Could not generate the derivatives of image %s', image_id)
+    finally:
+        connection.close()      # the connection of this worker thread
+
+
+def derivatives_dir(name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if not name.startswith('blobs/'):
+        stem = hashlib.sha256(name.encode()).hexdigest()    # not content-addressed
+    return f'derivatives/{stem}'
+
+
+def encode(picture, image_format):
+    buffer = BytesIO()
+    if image_format == 'WEBP':
+        picture.save(buffer, 'WEBP', quality=80, method=4)
+    elif image_format == 'PNG':
+        picture.save(buffer, 'PNG', optimize=True)
+    else:
+        picture.convert('RGB').save(buffer, 'JPEG', quality=85, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def build_variants(name):
+    """
+    Creates the missing variants of the original image `name` and returns
+    {'width': <original width>, 'variants': [{'width', 'type', 'name'}, ...]}.
+    """
+    directory = derivatives_dir(name)
+    with blob_storage.open(name, 'rb') as f:
+        original = PILImage.open(f)
+        original_format = original.format
+        picture = ImageOps.exif_transpose(original)
+        picture.load()
+    width, height = picture.size
+    # Keep the original format for the fallback, but PNG for transparency / non photos.
+    fallback = 'JPEG' if original_format == 'JPEG' else 'PNG'
+
+    variants = []
+    targets = [target for target in sorted(settings.IMAGE_DERIVATIVE_WIDTHS) if target < width]
+    # WebP in every width, including the original one (the original file is the full size
+    # candidate of the other format); never upscaled.
+    for target in targets + [width]:
+        resized = None
+        for image_format in ('WEBP', fallback) if target < width else ('WEBP',):
+            variant = f'{directory}/{target}.{image_format.lower()}'
+            if not default_storage.exists(variant):
+                if resized is None:
+                    resized = picture if target == width else picture.resize(
+                        (target, max(1, round(height * target / width))), PILImage.LANCZOS
+                    )
+                variant = default_storage.save(variant, ContentFile(encode(resized, image_format)))
+            variants.append(
+                {'width': target, 'type': f'image/{image_format.lower()}', 'name': variant}
+            )
+    return {'width': width, 'variants': variants}
+
+
+def generate_derivatives(image_id):
+    from .signals import bump_item_contents     # here: the signals module imports this one
+
+    image = Image.objects.filter(pk=image_id).first()
+    if image is None or not image.file:
+        return
+    derivatives = build_variants(image.file.name)
+    # Only if the file wasn't replaced meanwhile (a new file queues its own generation).
+    if Image.objects.filter(pk=image.pk, file=image.file.name).update(derivatives=derivatives):
+        image.derivatives = derivatives
+        image.refresh_render()
+        bump_item_contents(Image, image.pk)
+
+
+def delete_derivatives(name):
+    # When the original is deleted (courses.storage.release_blob()).
+    directory = derivatives_dir(name)
+    if default_storage.exists(directory):
+        for filename in default_storage.listdir(directory)[1]:
+            default_storage.delete(f'{directory}/{filename}')
+
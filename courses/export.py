@@ -0,0 +1,109 @@
+import json
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from .models import Content, Module, Subject
+
+
+# Streaming export (JSON Lines)
+# One JSON object per line, written while the rows are read: subjects first, then every
+# course followed by its modules and its contents (with the resolved Text/Video/Image/File).
+# Rows are fetched with chunked iterators, so memory stays flat whatever the size of the
+# export, and the first bytes are sent before the whole catalog has been read.
+#
+# {"type": "subject", "id": 1, "title": "...", "slug": "..."}
+# {"type": "course", "id": 3, "subject": 1, "owner": 2, "title": "...", ...}
+# {"type": "module", "id": 7, "course": 3, "order": 0, "title": "...", "description": "..."}
+# {"type": "content", "id": 12, "module": 7, "order": 0, "item": {"type": "text", ...}}
+
+CHUNK_SIZE = 500
+
+
+def to_line(obj):
+    return json.dumps(obj, cls=DjangoJSONEncoder) + '\n'
+
+
+def serialize_item(item):
+    data = {
+        'type': item._meta.model_name,
+        'id': item.id,
+        'owner': item.owner_id,
+        'title': item.title,
+        'created': item.created,
+        'updated': item.updated,
+    }
+    if data['type'] == 'text':
+        data['content'] = item.content
+    elif data['type'] == 'video':
+        data['url'] = item.url
+    else:   # 'file' and 'image'
+        data['file'] = item.file.name
+    return data
+
+
+def export_lines(courses, chunk_size=CHUNK_SIZE):
+    """
+    Yields the JSON lines of the given courses (a Course queryset), with their subjects.
+    """
+    subjects = Subject.objects.filter(
+        pk__in=courses.values('subject_id')
+    ).values('id', 'title', 'slug')
+    for subject in subjects.iterator(chunk_size=chunk_size):
+        yield to_line({'type': 'subject', **subject})
+
+    for course in courses.order_by('pk').iterator(chunk_size=chunk_size):
+        yield to_line({
+            'type': 'course',
+            'id': course.id,
+            'subject': course.subject_id,
+            'owner': course.owner_id,
+            'title': course.title,
+            'slug': course.slug,
+            'overview': course.overview,
+            'created': course.created,
+        })
+        modules = Module.objects.filter(course=course).values(
+            'id', 'course_id', 'order', 'title', 'description'
+        )
+        for module in modules.iterator(chunk_size=chunk_size):
+            yield to_line({
+                'type': 'module',
+                'id': module['id'],
+                'course': module['course_id'],
+                'order': module['order'],
+                'title': module['title'],
+                'description': module['description'],
+            })
+        # with_items() + iterator(chunk_size): the items are prefetched chunk by chunk
+        contents = Content.objects.filter(
+            module__course=course
+        ).order_by('module__order', 'order').with_items()
+        for content in contents.iterator(chunk_size=chunk_size):
+            yield to_line({
+                'type': 'content',
+                'id': content.id,
+                'module': content.module_id,
+                'order': content.order,
+                'item': serialize_item(content.item) if content.item else None,
+            })
+
+
+async def aiter_lines(lines, batch_size=100):
+    # Under ASGI, a synchronous iterator would be consumed entirely before being sent.
+    # Pull the lines in small batches from a worker thread instead.
+    next_batch = sync_to_async(lambda: ''.join(islice(lines, batch_size)))
+    while chunk := await next_batch():
+        yield chunk
+
+
+def export_response(request, courses, filename):
+    lines = export_lines(courses)
+    request = getattr(request, '_request', request)     # the HttpRequest of a DRF Request
+    response = StreamingHttpResponse(
+        aiter_lines(lines) if isinstance(request, ASGIRequest) else lines,
+        content_type='application/x-ndjson'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
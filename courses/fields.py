@@ -1,5 +1,7 @@
+from django.apps import apps
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import F
 
 
 class OrderField(models.PositiveIntegerField):
@@ -10,26 +12,99 @@ class OrderField(models.PositiveIntegerField):
     def pre_save(self, model_instance, add):
         if getattr(model_instance, self.attname) is None:
             # no current value
-            try:
-                qs = self.model.objects.all()
-                if self.for_fields:
-                    # filter by objects with the same field values
-                    # for the fields in "for_fields"
-                    query = {
-                        field: getattr(model_instance, field) for field in self.for_fields
-                    }
-                    qs = qs.filter(**query)
-
-                # get the order of the last item
-                last_item = qs.latest(self.attname)
-                value = getattr(last_item, self.attname) + 1
-
-            except ObjectDoesNotExist:
-                value = 0
+            value = self.allocate(model_instance)
             setattr(model_instance, self.attname, value)
             return value
 
         else:
-            return super().pre_save(model_instance, add)
+            value = super().pre_save(model_instance, add)
+            if not model_instance.__dict__.pop('_order_counted', False):
+                # Explicit order (save(order=n)): the next allocated one must come after it.
+                self.advance(self.get_scope(model_instance), value)
+            return value
+
+    def get_scope(self, model_instance):
+        # Identifies the "parent" the order is counted in, e.g. 'courses.module:3' for the
+        # modules of the course 3 (for_fields=['course']).
+        values = [
+            str(getattr(model_instance, self.model._meta.get_field(field).attname))
+            for field in self.for_fields or []
+        ]
+        return ':'.join([self.model._meta.label_lower, *values])
+
+    def last_order(self, model_instance):
+        # Scans the table for the biggest order of the parent. Only used to initialize
+        # the counter of a parent the first time an order is allocated for it.
+        qs = self.model._default_manager.all()
+        if self.for_fields:
+            # filter by objects with the same field values
+            # for the fields in "for_fields"
+            query = {
+                field: getattr(model_instance, field) for field in self.for_fields
+            }
+            qs = qs.filter(**query)
+        try:
+            # get the order of the last item
+            return getattr(qs.latest(self.attname), self.attname)
+        except ObjectDoesNotExist:
+            return None
+
+    def counters(self):
+        OrderCounter = apps.get_model('courses', 'OrderCounter')
+        return OrderCounter._default_manager.db_manager(router.db_for_write(self.model))
+
+    def advance(self, scope, order):
+        # Moves the counter of the parent past `order` (if the counter exists: otherwise the
+        # first allocation starts after the existing rows anyway).
+        self.counters().filter(scope=scope, value__lte=order).update(value=order + 1)
+
+    def delete_counter(self, **parent):
+        # When the parent is deleted, e.g. Module._meta.get_field('order').delete_counter(course=course)
+        self.counters().filter(scope=self.get_scope(self.model(**parent))).delete()
 
+    def allocate(self, model_instance, count=1):
+        """
+        Reserves `count` consecutive orders in the parent of `model_instance` and returns the first.
+        The next free order of each parent is kept in an OrderCounter row. Incrementing it with
+        UPDATE ... SET value = value + count locks the row until the transaction ends, so
+        concurrent writers get distinct orders instead of both reading the same max().
+        """
+        counters = self.counters()
+        scope = self.get_scope(model_instance)
+        with transaction.atomic(using=counters.db):
+            if not counters.filter(scope=scope).update(value=F('value') + count):
+                # First allocation for this parent: start after the existing objects.
+                last = self.last_order(model_instance)
+                start = 0 if last is None else last + 1
+                try:
+                    with transaction.atomic(using=counters.db):
+                        counters.create(scope=scope, value=start + count)
+                    return start
+                except IntegrityError:
+                    # Another writer created the counter first, use it.
+                    counters.filter(scope=scope).update(value=F('value') + count)
+            value = counters.filter(scope=scope).values_list('value', flat=True).get()
+        return value - count
 
+    def assign(self, instances):
+        """
+        Gives consecutive orders to all the instances without one, with one allocation per parent
+        instead of one per instance (used by OrderedQuerySet.bulk_create()). The counters are also
+        moved past the explicit orders, once per parent.
+        """
+        groups = {}
+        explicit = {}
+        for instance in instances:
+            scope = self.get_scope(instance)
+            order = getattr(instance, self.attname)
+            if order is None:
+                groups.setdefault(scope, []).append(instance)
+            else:
+                explicit[scope] = max(explicit.get(scope, order), order)
+            instance._order_counted = True      # pre_save() has nothing left to do
+        for scope, order in explicit.items():
+            self.advance(scope, order)
+        for group in groups.values():
+            start = self.allocate(group[0], count=len(group))
+            for offset, instance in enumerate(group):
+                setattr(instance, self.attname, start + offset)
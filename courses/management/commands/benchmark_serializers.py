@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from courses import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a benchmark catalog and compares the time to serialize a page of the course and '
+        'subject API lists from model instances and from values() rows. Prints a JSON report '
+        'and fails if the outputs differ. Everything is rolled back at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subjects', type=int, default=5)
+        parser.add_argument('--courses', type=int, default=10, help='Courses per subject.')
+        parser.add_argument('--modules', type=int, default=8, help='Modules per course.')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', help='Also write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        with override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        ), transaction.atomic():
+            report = benchmark.serialization(
+                repeat=options['repeat'],
+                page_size=options['page_size'],
+                subjects=options['subjects'],
+                courses=options['courses'],
+                modules=options['modules'],
+                contents=0,
+                students=2,
+            )
+            transaction.set_rollback(True)     # don't keep the seeded catalog
+
+        output = benchmark.to_json(report)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        different = [name for name, result in report['results'].items() if not result['identical']]
+        if different:
+            raise CommandError(f"Different output: {', '.join(different)}")
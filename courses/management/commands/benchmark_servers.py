@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from courses import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the throughput of the public catalog and API views served through the WSGI '
+        'and the ASGI application, and prints a JSON report. The benchmark catalog is created '
+        'in the database (the requests run in other threads) and deleted at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per server.')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight.')
+        parser.add_argument('--subjects', type=int, default=3)
+        parser.add_argument('--courses', type=int, default=5, help='Courses per subject.')
+        parser.add_argument('--modules', type=int, default=4, help='Modules per course.')
+        parser.add_argument(
+            '--configured-cache', action='store_true',
+            help='Use the configured cache (Redis) instead of an in-process one: the async '
+                 'views then overlap the Redis round trips too.'
+        )
+        parser.add_argument('--output', help='Also write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        settings = {'DEBUG': False, 'ALLOWED_HOSTS': ['testserver']}
+        if not options['configured_cache']:
+            settings['CACHES'] = {
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+            }
+        with override_settings(**settings):
+            seed = benchmark.seed_catalog(
+                subjects=options['subjects'], courses=options['courses'],
+                modules=options['modules'], contents=2, students=2,
+            )
+            try:
+                report = benchmark.throughput(
+                    benchmark.public_urls(seed),
+                    total=options['requests'],
+                    concurrency=options['concurrency'],
+                )
+            finally:
+                benchmark.clear_catalog()
+
+        output = benchmark.to_json(report)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from courses import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a benchmark catalog, measures query count, time and response size of the '
+        'catalog/student/API views and prints a JSON report. Everything is rolled back at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subjects', type=int, default=3)
+        parser.add_argument('--courses', type=int, default=5, help='Courses per subject.')
+        parser.add_argument('--modules', type=int, default=4, help='Modules per course.')
+        parser.add_argument('--contents', type=int, default=8, help='Contents per module.')
+        parser.add_argument('--students', type=int, default=20, help='Students per course.')
+        parser.add_argument('--repeat', type=int, default=5, help='Measured requests per view.')
+        parser.add_argument(
+            '--warm-cache', action='store_true',
+            help="Don't clear the cache between requests (measure the cached path)."
+        )
+        parser.add_argument('--output', help='Also write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        # A private in-process cache (the numbers don't depend on the Redis service and the
+        # benchmark doesn't pollute it), and no debug toolbar.
+        with override_settings(
+            DEBUG=False,
+            ALLOWED_HOSTS=['testserver'],
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        ), transaction.atomic():
+            report = benchmark.run(
+                repeat=options['repeat'],
+                warm_cache=options['warm_cache'],
+                subjects=options['subjects'],
+                courses=options['courses'],
+                modules=options['modules'],
+                contents=options['contents'],
+                students=options['students'],
+            )
+            transaction.set_rollback(True)     # don't keep the seeded catalog
+
+        output = benchmark.to_json(report)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        if report['over_budget']:
+            raise CommandError(f"Query budget exceeded: {', '.join(report['over_budget'])}")
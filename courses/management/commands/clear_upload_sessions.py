@@ -0,0 +1,15 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from courses.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Deletes the resumable uploads that were not completed in time (and their chunks).'
+
+    def handle(self, *args, **options):
+        expired = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_MAX_AGE)
+        # delete() sends post_delete for every session: the part files are removed too
+        deleted, _ = UploadSession.objects.filter(created__lt=expired).delete()
+        self.stdout.write(self.style.SUCCESS(f'{deleted} upload session(s) deleted'))
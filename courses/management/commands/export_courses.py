@@ -0,0 +1,29 @@
+import sys
+from django.core.management.base import BaseCommand
+from courses.export import export_lines
+from courses.models import Course
+
+
+class Command(BaseCommand):
+    help = 'Exports courses (all of them by default) with their subjects, modules and contents as JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, nargs='+', dest='courses', help='Course ids to export')
+        parser.add_argument('--output', help='File to write the export to (stdout by default)')
+
+    def handle(self, *args, **options):
+        courses = Course.objects.all()
+        if options['courses']:
+            courses = courses.filter(pk__in=options['courses'])
+
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        lines = 0
+        try:
+            for line in export_lines(courses):
+                output.write(line)
+                lines += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f'{lines} line(s) written to {options["output"]}'))
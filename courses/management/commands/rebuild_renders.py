@@ -0,0 +1,42 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from courses.models import template_fingerprint
+
+
+ITEM_MODELS = ['text', 'video', 'image', 'file']
+
+
+class Command(BaseCommand):
+    help = 'Re-renders the stored HTML of content items (run it after deploying content templates).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model', choices=ITEM_MODELS, action='append',
+            help='Only rebuild this item model (can be repeated). Default: all of them.'
+        )
+        parser.add_argument(
+            '--stale-only', action='store_true',
+            help='Skip items already rendered with the current template.'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model_name in options['model'] or ITEM_MODELS:
+            model = apps.get_model('courses', model_name)
+            items = model.objects.order_by('pk')
+            if options['stale_only']:
+                items = items.exclude(rendered_key=template_fingerprint(f'courses/content/{model_name}.html'))
+
+            total = 0
+            batch = []
+            # iterator() streams the rows instead of loading the whole table in memory.
+            for item in items.iterator(chunk_size=batch_size):
+                item.refresh_render(commit=False)
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    total += model.objects.bulk_update(batch, ['rendered', 'rendered_key'])
+                    batch = []
+            if batch:
+                total += model.objects.bulk_update(batch, ['rendered', 'rendered_key'])
+            self.stdout.write(f'{model_name}: {total} item(s) re-rendered')
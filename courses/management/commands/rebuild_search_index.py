@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from courses.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of courses, modules and text contents.'
+
+    def handle(self, *args, **options):
+        total = get_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS(f'{total} document(s) indexed'))
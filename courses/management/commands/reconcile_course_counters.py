@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from courses.models import Course, Subject
+
+
+class Command(BaseCommand):
+    help = 'Repairs the denormalized counters of courses (total_modules, total_students) that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true', help='Only report the courses with wrong counters.'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        drifted = list(
+            Course.objects.with_counter_drift().values_list('pk', flat=True).order_by('pk')
+        )
+        self.stdout.write(f'{len(drifted)} course(s) with wrong counters')
+        if options['dry_run'] or not drifted:
+            return
+
+        batch_size = options['batch_size']
+        for start in range(0, len(drifted), batch_size):
+            Course.objects.filter(pk__in=drifted[start:start + batch_size]).refresh_counters()
+        # the popular courses ranking is based on total_students
+        Subject.objects.filter(courses__in=drifted).distinct().refresh_popular_courses()
+        self.stdout.write(self.style.SUCCESS(f'{len(drifted)} course(s) repaired'))
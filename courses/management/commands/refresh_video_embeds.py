@@ -0,0 +1,48 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from courses.caching import bump_version, module_contents_family
+from courses.models import Content, Video
+
+
+FIELDS = ['backend', 'embed_url', 'thumbnail_url', 'rendered', 'rendered_key']
+
+
+class Command(BaseCommand):
+    help = (
+        'Resolves the embed data (backend, player and thumbnail URLs) of the videos and '
+        're-renders them. Run it once for the videos saved before these fields existed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing', action='store_true', help='Only the videos without embed data yet.'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        videos = Video.objects.order_by('pk')
+        if options['missing']:
+            videos = videos.filter(embed_url='')
+
+        total = unresolved = 0
+        batch = []
+        for video in videos.iterator(chunk_size=batch_size):
+            video.refresh_embed()
+            video.refresh_render(commit=False)
+            unresolved += not video.embed_url
+            batch.append(video)
+            if len(batch) >= batch_size:
+                total += Video.objects.bulk_update(batch, FIELDS)
+                batch = []
+        if batch:
+            total += Video.objects.bulk_update(batch, FIELDS)
+
+        # bulk_update() sends no signals: invalidate the cached contents of the modules with videos.
+        module_ids = Content.objects.filter(
+            content_type=ContentType.objects.get_for_model(Video)
+        ).values_list('module_id', flat=True).distinct()
+        bump_version(*[module_contents_family(module_id) for module_id in module_ids])
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} video(s) updated, {unresolved} without a known provider (rendered as links)'
+        ))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from courses.catalog import warm
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds the catalog cache entries and the cached contents of every module, the most '
+        'enrolled courses first (e.g. after a deploy or a cache flush).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4, help='Entries built at the same time.'
+        )
+        parser.add_argument(
+            '--force', action='store_true', help='Rebuild the entries that are already cached.'
+        )
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(result, done):
+            if verbosity > 1 or result['status'] == 'failed':
+                self.stdout.write(
+                    f"[{done}] {result['entry']}: {result['status']} ({result.get('ms', '-')} ms)"
+                )
+            elif verbosity and done % 100 == 0:
+                self.stdout.write(f'{done} entries...')
+
+        report = warm(workers=options['workers'], force=options['force'], progress=progress)
+        built = [r['ms'] for r in report['results'] if r['status'] == 'built']
+        slowest = max(built, default=0)
+        message = (
+            f"{report['entries']} entries in {report['seconds']}s: {report['built']} built, "
+            f"{report['cached']} already cached, {report['failed']} failed "
+            f"(slowest build {slowest} ms)"
+        )
+        self.stdout.write(self.style.ERROR(message) if report['failed'] else self.style.SUCCESS(message))
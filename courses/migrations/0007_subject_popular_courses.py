@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:47
+
+from django.db import migrations, models
+
+
+def compute_popular_courses(apps, schema_editor):
+    Subject = apps.get_model('courses', 'Subject')
+    Course = apps.get_model('courses', 'Course')
+    for subject in Subject.objects.all():
+        courses = Course.objects.filter(subject=subject).annotate(
+            total_students=models.Count('students')
+        ).order_by('-total_students', '-created')[:3]
+        subject.popular_courses = [
+            {'id': c.id, 'title': c.title, 'total_students': c.total_students}
+            for c in courses
+        ]
+        subject.save(update_fields=['popular_courses'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0006_ordercounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subject',
+            name='popular_courses',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(compute_popular_courses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:49
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_per_course(model):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                course=OuterRef('pk')
+            ).order_by().values('course').annotate(total=Count('pk')).values('total')
+        ),
+        0
+    )
+
+
+def compute_counters(apps, schema_editor):
+    Course = apps.get_model('courses', 'Course')
+    Module = apps.get_model('courses', 'Module')
+    Course.objects.update(
+        total_modules=count_per_course(Module),
+        total_students=count_per_course(Course.students.through),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_subject_popular_courses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='total_modules',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='total_students',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # The SQLite FTS5 index of courses.search.SQLiteFTSBackend. Other databases need
+    # their own backend (settings.SEARCH_BACKEND) and set up their index themselves.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from courses.search import SQLiteFTSBackend
+    for sql in SQLiteFTSBackend.create_table_sql():
+        schema_editor.execute(sql)
+    SQLiteFTSBackend().rebuild(apps)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from courses.search import SQLiteFTSBackend
+    schema_editor.execute(f'DROP TABLE IF EXISTS {SQLiteFTSBackend.table}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('courses', '0008_course_total_modules_course_total_students'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
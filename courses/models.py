@@ -1,15 +1,56 @@
+import hashlib
+import os
+import uuid
+from functools import lru_cache
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.safestring import mark_safe
 from .fields import OrderField
-from django.template.loader import render_to_string
+from .storage import blob_storage
+from embed_video.backends import EmbedVideoException, detect_backend
+from requests import RequestException
+from django.template.loader import get_template, render_to_string
 
 
 
+class SubjectQuerySet(models.QuerySet):
+    def refresh_popular_courses(self):
+        # Recomputes the stored ranking of the selected subjects (one query + one update each).
+        # Called when enrollments or courses change, so reading the ranking costs no query.
+        for subject_id in self.values_list('pk', flat=True):
+            courses = Course.objects.filter(
+                subject_id=subject_id
+            ).order_by('-total_students', '-created')[:Subject.POPULAR_COURSES]
+            self.model.objects.filter(pk=subject_id).update(
+                popular_courses=[
+                    {'id': c.id, 'title': c.title, 'total_students': c.total_students}
+                    for c in courses
+                ],
+                # also called when courses are added/removed: total_courses may have changed
+                updated=timezone.now(),
+            )
+
+
 class Subject(models.Model):
+    POPULAR_COURSES = 3     # size of the popular_courses ranking
+
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True)
+    # Most enrolled courses, most popular first: [{'id': .., 'title': .., 'total_students': ..}, ...]
+    # Kept up to date by the signal handlers in courses/signals.py.
+    popular_courses = models.JSONField(default=list, blank=True, editable=False)
+    # Last change of what the API shows for the subject (ETag / Last-Modified, courses/api/views.py):
+    # saved by the subject itself and by refresh_popular_courses().
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = SubjectQuerySet.as_manager()
 
     class Meta:
         ordering = ['title']
@@ -18,6 +59,84 @@ class Subject(models.Model):
         return self.title
 
 
+def count_per_course(model):
+    # Correlated subquery counting the rows of `model` that point to the outer course.
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                course=OuterRef('pk')
+            ).order_by().values('course').annotate(total=models.Count('pk')).values('total')
+        ),
+        0
+    )
+
+
+class CourseQuerySet(models.QuerySet):
+    def counters(self):
+        # {counter field: expression computing its real value}
+        return {
+            'total_modules': count_per_course(Module),
+            'total_students': count_per_course(Course.students.through),
+        }
+
+    def touch(self):
+        # Marks the selected courses as changed (e.g. one of their modules was): see Course.updated.
+        return self.update(updated=timezone.now())
+
+    def refresh_counters(self, fields=None):
+        # Recomputes the denormalized counters of the selected courses with a single UPDATE.
+        counters = self.counters()
+        return self.update(
+            **{field: counters[field] for field in fields or counters}
+        )
+
+    def refresh_enrollment_stats(self):
+        # Everything derived from the enrollments of the selected courses. First the counters:
+        # the popular courses ranking of the subjects is based on them.
+        self.refresh_counters(['total_students'])
+        Subject.objects.filter(courses__in=self).distinct().refresh_popular_courses()
+
+    def bulk_enroll(self, pairs, batch_size=1000):
+        """
+        Enrolls users in courses from (course_id, user_id) pairs with chunked bulk inserts
+        into the Course.students table, skipping the enrollments that already exist.
+        Returns (attempted, existing): the pairs inserted, and those found enrolled before. An
+        attempted pair may have been enrolled concurrently in the meantime (the insert ignores
+        conflicts and doesn't tell which rows it skipped), so it is not reported as "created".
+        No m2m_changed signal is sent: the enrollment counters and rankings are refreshed once
+        at the end instead.
+        """
+        Enrollment = Course.students.through
+        pairs = sorted(set(pairs))     # sorted by course: each chunk only touches a few courses
+        attempted = 0
+        with transaction.atomic():
+            for start in range(0, len(pairs), batch_size):
+                chunk = pairs[start:start + batch_size]
+                existing = set(
+                    Enrollment.objects.filter(
+                        course_id__in={course_id for course_id, user_id in chunk},
+                        user_id__in={user_id for course_id, user_id in chunk},
+                    ).values_list('course_id', 'user_id')
+                )
+                new = [
+                    Enrollment(course_id=course_id, user_id=user_id)
+                    for course_id, user_id in chunk if (course_id, user_id) not in existing
+                ]
+                # ignore_conflicts: a concurrent enrollment of the same pair is not an error
+                Enrollment.objects.bulk_create(new, ignore_conflicts=True)
+                attempted += len(new)
+            self.filter(pk__in={course_id for course_id, user_id in pairs}).refresh_enrollment_stats()
+        return attempted, len(pairs) - attempted
+
+    def with_counter_drift(self):
+        # Courses whose stored counters don't match the real counts.
+        return self.annotate(
+            **{f'actual_{field}': value for field, value in self.counters().items()}
+        ).exclude(
+            **{field: F(f'actual_{field}') for field in self.counters()}
+        )
+
+
 class Course(models.Model):
     owner = models.ForeignKey(
         User,
@@ -33,11 +152,21 @@ class Course(models.Model):
     slug = models.SlugField(max_length=200, unique=True)
     overview = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
+    # Last change of the course or of its modules (ETag / Last-Modified of the API,
+    # courses/api/views.py). Module changes go through CourseQuerySet.touch().
+    updated = models.DateTimeField(auto_now=True)
     students = models.ManyToManyField(
         User,
         related_name='course_joined',
         blank=True
     )
+    # Denormalized counters, so listing pages don't aggregate over the modules and enrollment
+    # tables. Kept up to date by courses/signals.py, repaired by 'manage.py reconcile_course_counters'.
+    COUNTER_FIELDS = ['total_modules', 'total_students']
+    total_modules = models.PositiveIntegerField(default=0, editable=False)
+    total_students = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CourseQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created']
@@ -45,6 +174,36 @@ class Course(models.Model):
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The counters are only written by CourseQuerySet.refresh_counters(): saving an instance
+            # loaded earlier (e.g. in an edit form) must not write back counters that are stale by now.
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+
+class OrderedQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # Assign the OrderField values of all the new rows up front: one counter
+        # update per parent instead of one per row.
+        objs = list(objs)
+        for field in self.model._meta.concrete_fields:
+            if isinstance(field, OrderField):
+                field.assign(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class OrderCounter(models.Model):
+    # Next free value of an OrderField per parent (e.g. per course for modules), see OrderField.allocate().
+    scope = models.CharField(max_length=200, unique=True)
+    value = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.scope}: {self.value}'
+
 
 class Module(models.Model):
     course = models.ForeignKey(
@@ -56,6 +215,8 @@ class Module(models.Model):
     # by setting for_fields=['course'], this means that the order for a new module will be
     # assigned by adding 1 to the last module of the same 'Course' object.
 
+    objects = OrderedQuerySet.as_manager()
+
     class Meta:
         ordering = ['order']
 
@@ -63,6 +224,16 @@ class Module(models.Model):
         return f'{self.order}. {self.title}'
 
 
+class ContentQuerySet(OrderedQuerySet):
+    def with_items(self):
+        # Resolving content.item one row at a time costs one query per Content object.
+        # prefetch_related() on the GenericForeignKey groups the rows by content_type
+        # and loads every Text/Video/Image/File in one query per item model, so a module
+        # is rendered with a constant number of queries no matter how many items it has.
+        # The queryset stays lazy: nothing is fetched until it is iterated.
+        return self.prefetch_related('item')
+
+
 class Content(models.Model):
     module = models.ForeignKey(
         Module,
@@ -81,15 +252,38 @@ class Content(models.Model):
     order = OrderField(blank=True, for_fields=['module'])
     # This time, you specify that the order is calculated w.r.t. the module field.
 
+    objects = ContentQuerySet.as_manager()
+
     class Meta:
         ordering = ['order']
 
+def _template_fingerprint(template_name):
+    template = get_template(template_name)
+    return hashlib.sha1(template.template.source.encode()).hexdigest()
+
+_cached_template_fingerprint = lru_cache(maxsize=None)(_template_fingerprint)
+
+
+def template_fingerprint(template_name):
+    """
+    Returns a hash of the source of the given template.
+    Stored next to a pre-rendered item so a changed template is detected on the next render.
+    Outside DEBUG the hash is computed once per process (templates only change on deploy).
+    """
+    if settings.DEBUG:
+        return _template_fingerprint(template_name)
+    return _cached_template_fingerprint(template_name)
+
+
 # Abstract Model
 class ItemBase(models.Model):
     owner = models.ForeignKey(User, related_name='%(class)s_related', on_delete=models.CASCADE)
     title = models.CharField(max_length=250)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    # Pre-rendered HTML of the item and the fingerprint of the template it was rendered with.
+    rendered = models.TextField(blank=True, editable=False)
+    rendered_key = models.CharField(max_length=40, blank=True, editable=False)
 
     class Meta:
         abstract = True     # I'm just a blueprint, don't make a database table for me.
@@ -97,13 +291,38 @@ class ItemBase(models.Model):
     def __str__(self):
         return self.title
 
-    def render(self):
+    def save(self, *args, **kwargs):
+        # One transaction, so the on_commit() cache invalidation (courses/signals.py) happens
+        # once the new HTML is stored, not in between.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Render after saving, so uploaded files already have their final name/URL.
+            self.refresh_render()
+
+    @property
+    def template_name(self):
+        # self._meta.model_name = 'text' or 'video' or 'image' or 'file'
+        return f'courses/content/{self._meta.model_name}.html'
+
+    def render_html(self):
         # render_to_string() = Converts template + data -> HTML string
-        return render_to_string(
-            # self._meta.model_name = 'text' or 'video' or 'image' or 'file'
-            f'courses/content/{self._meta.model_name}.html',
-            {'item': self}
-        )
+        return render_to_string(self.template_name, {'item': self})
+
+    def refresh_render(self, commit=True):
+        self.rendered = self.render_html()
+        self.rendered_key = template_fingerprint(self.template_name)
+        if commit:
+            # update() instead of save(): no signals, no 'updated' bump, just the two columns.
+            type(self).objects.filter(pk=self.pk).update(
+                rendered=self.rendered, rendered_key=self.rendered_key
+            )
+
+    def render(self):
+        # Served from the stored HTML. It is only rendered again when the item was never
+        # rendered or its template changed since (e.g. after a template deploy).
+        if self.rendered_key != template_fingerprint(self.template_name):
+            self.refresh_render()
+        return mark_safe(self.rendered)
 
 
 # Child Models
@@ -111,14 +330,107 @@ class Text(ItemBase):
     content = models.TextField()
 
 
+# Stored once per content (courses/storage.py); indexed to count the references of a blob.
 class File(ItemBase):
-    file = models.FileField(upload_to='files')
+    file = models.FileField(upload_to='files', storage=blob_storage, db_index=True)
 
 
 class Image(ItemBase):
-    file = models.FileField(upload_to='images')
+    file = models.FileField(upload_to='images', storage=blob_storage, db_index=True)
+    # Smaller versions of the image, generated in the background (courses/derivatives.py):
+    # {'width': <original width>, 'variants': [{'width': 320, 'type': 'image/webp', 'name': ...}]}
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        if not self.file._committed:
+            # A new file is uploaded: the derivatives of the previous one don't apply anymore.
+            self.derivatives = {}
+        super().save(*args, **kwargs)
+
+    def get_srcset(self, webp):
+        candidates = [
+            f"{default_storage.url(v['name'])} {v['width']}w"
+            for v in self.derivatives.get('variants', [])
+            if (v['type'] == 'image/webp') == webp
+        ]
+        if candidates and not webp:
+            # the original file is the largest candidate
+            candidates.append(f"{self.file.url} {self.derivatives['width']}w")
+        return ', '.join(candidates)
+
+    @property
+    def webp_srcset(self):
+        return self.get_srcset(webp=True)
+
+    @property
+    def srcset(self):
+        # in the format of the original (JPEG or PNG)
+        return self.get_srcset(webp=False)
+
+
+# Resumable uploads
+# Large files are sent in chunks to /api/uploads/<id>/ (courses/api/views.py) and appended to
+# a part file; a client whose connection drops asks for the offset and resumes from there.
+# Once complete, the part file is moved into the content-addressed storage.
+class BlobLock(models.Model):
+    # One row per stored blob, locked (select_for_update) while a blob is stored and referenced,
+    # or released: see courses/storage.py.
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, related_name='upload_sessions', on_delete=models.CASCADE)
+    # Module the uploaded file is added to; owned by the uploader (checked when the session
+    # is created). Nullable only for the sessions created before the field existed.
+    module = models.ForeignKey(
+        'Module', related_name='upload_sessions', on_delete=models.CASCADE, null=True
+    )
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()     # announced total size, in bytes
+    offset = models.PositiveBigIntegerField(default=0)     # bytes received so far
+    created = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.UPLOAD_SESSIONS_DIR, f'{self.id}.part')
+
+    @property
+    def complete(self):
+        return self.offset == self.size
 
 
 class Video(ItemBase):
     url = models.URLField()
+    # Resolved once on save (refresh_embed()) instead of on every render by {% video %}:
+    # django-embed-video backend name, URL of the player and of the thumbnail.
+    backend = models.CharField(max_length=50, blank=True, editable=False)
+    embed_url = models.URLField(max_length=500, blank=True, editable=False)
+    thumbnail_url = models.URLField(max_length=500, blank=True, editable=False)
+
+    def refresh_embed(self):
+        # May call the video provider (thumbnails of Vimeo/SoundCloud, EMBED_VIDEO_TIMEOUT).
+        self.backend = self.embed_url = self.thumbnail_url = ''
+        try:
+            backend = detect_backend(self.url)
+            self.embed_url = str(backend.url)
+            self.backend = backend.backend
+            self.thumbnail_url = backend.thumbnail or ''
+        except (EmbedVideoException, RequestException, AttributeError, LookupError, TypeError, ValueError):
+            pass    # unknown provider or video, or provider unreachable: rendered as a link
+
+    def save(self, *args, **kwargs):
+        # Only when the URL changed, or wasn't resolved yet: e.g. renaming the video
+        # doesn't call the provider again.
+        if not self.embed_url or self.url != self.stored_url():
+            self.refresh_embed()
+        super().save(*args, **kwargs)
+
+    def stored_url(self):
+        if self._state.adding:
+            return None
+        return type(self).objects.filter(pk=self.pk).values_list('url', flat=True).first()
 
@@ -0,0 +1,223 @@
+import re
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import connections, router
+from django.utils.module_loading import import_string
+
+
+# Full-text search over courses, modules and text contents
+# The documents live in a search index kept up to date on save (courses/signals.py), so a
+# search never scans the base tables. The backend is pluggable (settings.SEARCH_BACKEND);
+# SQLiteFTSBackend stores the index in an FTS5 virtual table and ranks the hits with bm25.
+#
+# A document is (kind, object_id, course_id, title, body):
+# - 'course': Course.title / Course.overview
+# - 'module': Module.title / Module.description
+# - 'text':   Text.title / Text.content (course of the module the text belongs to)
+#
+# Searches can be restricted to some courses: courses=[ids] only returns the documents of those
+# courses, except the documents of public_kinds (e.g. the course documents are public, the
+# module and text ones only for the courses the user can see, see SearchView).
+
+KINDS = ('course', 'module', 'text')
+
+
+def tokenize(query):
+    return re.findall(r'\w+', query.lower())
+
+
+class SearchResults:
+    """
+    Lazy, sliceable list of hits (like a QuerySet), so the API pagination only fetches
+    one page of hits plus a count.
+    """
+    def __init__(self, backend, query, **filters):
+        self.backend = backend
+        self.query = query
+        self.filters = filters      # courses, public_kinds
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.backend.count(self.query, **self.filters)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start = index.start or 0
+            return self.backend.hits(
+                self.query, offset=start, limit=index.stop - start, **self.filters
+            )
+        return self.backend.hits(self.query, offset=index, limit=1, **self.filters)[0]
+
+
+class SearchBackend:
+    def index(self, kind, object_id, course_id, title, body):
+        raise NotImplementedError
+
+    def remove(self, kind, object_id):
+        raise NotImplementedError
+
+    def count(self, query, courses=None, public_kinds=()):
+        raise NotImplementedError
+
+    def hits(self, query, offset=0, limit=10, courses=None, public_kinds=()):
+        # [{'kind': .., 'id': .., 'course': .., 'title': .., 'snippet': ..}, ...] best first
+        raise NotImplementedError
+
+    def course_ids(self, query, limit=50, courses=None):
+        # ids of the courses with the best hits, best first
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def search(self, query, courses=None, public_kinds=()):
+        return SearchResults(self, query, courses=courses, public_kinds=public_kinds)
+
+    def documents(self, apps=django_apps):
+        # All the documents to index, from the base tables (used to (re)build the index).
+        Course = apps.get_model('courses', 'Course')
+        Module = apps.get_model('courses', 'Module')
+        Content = apps.get_model('courses', 'Content')
+        Text = apps.get_model('courses', 'Text')
+        for course in Course.objects.values('id', 'title', 'overview').iterator():
+            yield 'course', course['id'], course['id'], course['title'], course['overview']
+        for module in Module.objects.values('id', 'course_id', 'title', 'description').iterator():
+            yield 'module', module['id'], module['course_id'], module['title'], module['description']
+        text_courses = dict(
+            Content.objects.filter(
+                content_type__app_label='courses', content_type__model='text'
+            ).values_list('object_id', 'module__course_id')
+        )
+        for text in Text.objects.values('id', 'title', 'content').iterator():
+            if text['id'] in text_courses:
+                yield 'text', text['id'], text_courses[text['id']], text['title'], text['content']
+
+    def rebuild(self, apps=django_apps):
+        self.clear()
+        total = 0
+        for document in self.documents(apps):
+            self.index(*document)
+            total += 1
+        return total
+
+
+class SQLiteFTSBackend(SearchBackend):
+    # The table is created by the migration 'courses.0009_search_index'.
+    # The rowid encodes (kind, object_id), so updating/removing a document is a rowid lookup.
+    table = 'courses_search'
+    snippet_tokens = 16
+
+    @classmethod
+    def create_table_sql(cls):
+        return [
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {cls.table} USING fts5('
+            'title, body, kind UNINDEXED, object_id UNINDEXED, course_id UNINDEXED, '
+            "tokenize='porter unicode61')",
+            # 'rank' = bm25 with a match in the title worth 10 matches in the body
+            f"INSERT INTO {cls.table}({cls.table}, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+        ]
+
+    def get_connection(self, write=False):
+        Course = django_apps.get_model('courses', 'Course')
+        alias = router.db_for_write(Course) if write else router.db_for_read(Course)
+        return connections[alias]
+
+    @staticmethod
+    def rowid(kind, object_id):
+        return object_id * len(KINDS) + KINDS.index(kind)
+
+    @staticmethod
+    def match_expression(query):
+        # Every word must match, as a prefix ("djan" finds "django"). The words are quoted,
+        # so FTS5 operators typed by users are not interpreted.
+        return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+    @staticmethod
+    def course_filter(courses, public_kinds=()):
+        # SQL condition (and its parameters) restricting the hits to `courses`
+        if courses is None:
+            return '', []
+        courses = list(courses)
+        conditions = [f"course_id IN ({', '.join(['%s'] * len(courses))})"] if courses else []
+        conditions += ['kind = %s'] * len(public_kinds)
+        if not conditions:
+            return ' AND 0', []
+        return f" AND ({' OR '.join(conditions)})", [*courses, *public_kinds]
+
+    def index(self, kind, object_id, course_id, title, body):
+        with self.get_connection(write=True).cursor() as cursor:
+            rowid = self.rowid(kind, object_id)
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [rowid])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, body, kind, object_id, course_id) '
+                'VALUES (%s, %s, %s, %s, %s, %s)',
+                [rowid, title, body, kind, object_id, course_id]
+            )
+
+    def remove(self, kind, object_id):
+        with self.get_connection(write=True).cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE rowid = %s', [self.rowid(kind, object_id)]
+            )
+
+    def clear(self):
+        with self.get_connection(write=True).cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+    def count(self, query, courses=None, public_kinds=()):
+        match = self.match_expression(query)
+        if not match:
+            return 0
+        condition, params = self.course_filter(courses, public_kinds)
+        with self.get_connection().cursor() as cursor:
+            cursor.execute(
+                f'SELECT count(*) FROM {self.table} WHERE {self.table} MATCH %s{condition}',
+                [match, *params]
+            )
+            return cursor.fetchone()[0]
+
+    def hits(self, query, offset=0, limit=10, courses=None, public_kinds=()):
+        match = self.match_expression(query)
+        if not match or limit <= 0:
+            return []
+        condition, params = self.course_filter(courses, public_kinds)
+        with self.get_connection().cursor() as cursor:
+            cursor.execute(
+                f'SELECT kind, object_id, course_id, title, '
+                f"snippet({self.table}, 1, '', '', '…', {self.snippet_tokens}) "
+                f'FROM {self.table} WHERE {self.table} MATCH %s{condition} '
+                'ORDER BY rank LIMIT %s OFFSET %s',
+                [match, *params, limit, offset]
+            )
+            return [
+                {'kind': kind, 'id': object_id, 'course': course_id, 'title': title, 'snippet': snippet}
+                for kind, object_id, course_id, title, snippet in cursor.fetchall()
+            ]
+
+    def course_ids(self, query, limit=50, courses=None):
+        match = self.match_expression(query)
+        if not match:
+            return []
+        condition, params = self.course_filter(courses)
+        with self.get_connection().cursor() as cursor:
+            cursor.execute(
+                f'SELECT course_id FROM {self.table} WHERE {self.table} MATCH %s{condition} '
+                'GROUP BY course_id ORDER BY min(rank) LIMIT %s',
+                [match, *params, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.SEARCH_BACKEND)()
+    return _backend
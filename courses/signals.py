@@ -0,0 +1,264 @@
+import os
+import threading
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .caching import (
+    bump_version, course_structure_family, module_contents_family, subject_courses_family
+)
+from .models import Content, Course, File, Image, Module, Subject, Text, UploadSession, Video
+from .derivatives import queue_derivatives
+from .search import get_backend
+from .storage import release_blob
+
+
+# Catalog cache invalidation
+# Every write that changes what CourseListView shows bumps the version of the affected
+# key families only (see courses/caching.py).
+
+@receiver([post_save, post_delete], sender=Subject)
+def subject_changed(sender, instance, **kwargs):
+    # Subject titles/slugs appear in the sidebar and next to every course of the subject.
+    bump_version(
+        'catalog:subjects', 'catalog:courses', subject_courses_family(instance.pk)
+    )
+
+
+@receiver(pre_save, sender=Course)
+def remember_previous_subject(sender, instance, **kwargs):
+    # If the course is moved to another subject, the old subject's list must be invalidated too.
+    instance._previous_subject_id = None
+    if instance.pk:
+        instance._previous_subject_id = Course.objects.filter(
+            pk=instance.pk
+        ).values_list('subject_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Course)
+def course_changed(sender, instance, **kwargs):
+    families = {
+        'catalog:subjects',     # total_courses per subject
+        'catalog:courses',
+        subject_courses_family(instance.subject_id),
+        course_structure_family(instance.pk),
+    }
+    previous_subject_id = getattr(instance, '_previous_subject_id', None)
+    if previous_subject_id:
+        families.add(subject_courses_family(previous_subject_id))
+    bump_version(*families)
+
+    # The course may enter/leave the popular courses of its (previous) subject, or
+    # its title in the ranking may have changed.
+    refresh_popular_courses(instance.subject_id, previous_subject_id)
+
+
+@receiver([post_save, post_delete], sender=Module)
+def module_changed(sender, instance, **kwargs):
+    if kwargs.get('created', True):     # created, or deleted
+        Course.objects.filter(pk=instance.course_id).refresh_counters(['total_modules'])
+    # The modules are part of the course in the API.
+    Course.objects.filter(pk=instance.course_id).touch()
+
+    # total_modules of the course changes, and the module navigation of the student pages.
+    families = ['catalog:courses', course_structure_family(instance.course_id)]
+    subject_id = Course.objects.filter(
+        pk=instance.course_id
+    ).values_list('subject_id', flat=True).first()
+    if subject_id:     # None when the module is deleted together with its course
+        families.append(subject_courses_family(subject_id))
+    bump_version(*families)
+
+
+# OrderField counters (courses/fields.py) of a deleted parent: the modules of a course, the
+# contents of a module.
+
+@receiver(post_delete, sender=Course)
+def delete_module_order_counter(sender, instance, **kwargs):
+    Module._meta.get_field('order').delete_counter(course=instance)
+
+
+@receiver(post_delete, sender=Module)
+def delete_content_order_counter(sender, instance, **kwargs):
+    Content._meta.get_field('order').delete_counter(module=instance)
+
+
+# Module contents
+# The contents of a module are cached per 'module:<id>:contents' version on the student pages.
+# Bumped on commit, so a request can't cache the old contents under the new version.
+
+def bump_module_contents(*module_ids):
+    families = [module_contents_family(module_id) for module_id in module_ids]
+    transaction.on_commit(lambda: bump_version(*families))
+
+
+@receiver([post_save, post_delete], sender=Content)
+def content_changed(sender, instance, **kwargs):
+    bump_module_contents(instance.module_id)
+
+
+def bump_item_contents(model, item_id):
+    # An item belongs to the module(s) of the Content(s) pointing to it.
+    module_ids = Content.objects.filter(
+        content_type=ContentType.objects.get_for_model(model), object_id=item_id
+    ).values_list('module_id', flat=True)
+    bump_module_contents(*module_ids)
+
+
+@receiver([post_save, post_delete], sender=Text)
+@receiver([post_save, post_delete], sender=File)
+@receiver([post_save, post_delete], sender=Image)
+@receiver([post_save, post_delete], sender=Video)
+def item_changed(sender, instance, **kwargs):
+    bump_item_contents(sender, instance.pk)
+
+
+# Popular courses
+# The ranking of a subject is recomputed on commit, once for all the enrollments and course
+# changes of the transaction (e.g. a view enrolling a whole group one by one) instead of once
+# per write. Each write registers a callback, the first one to run refreshes everything pending
+# and the others find nothing left. Per thread: each thread has its own connection/transaction.
+
+pending_rankings = threading.local()
+
+
+def refresh_popular_courses(*subject_ids):
+    pending = pending_rankings.__dict__.setdefault('subject_ids', set())
+    pending.update(subject_id for subject_id in subject_ids if subject_id is not None)
+    transaction.on_commit(refresh_pending_rankings)
+
+
+def refresh_pending_rankings():
+    # (subjects left pending by a rolled back transaction are refreshed too: harmless)
+    subject_ids = pending_rankings.__dict__.pop('subject_ids', None)
+    if subject_ids:
+        Subject.objects.filter(pk__in=subject_ids).refresh_popular_courses()
+
+
+# Enrollments
+# course.students.add(user) / user.course_joined.add(course) and their remove()/clear().
+
+@receiver(m2m_changed, sender=Course.students.through)
+def enrollment_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # user.course_joined.clear(): remember the courses, they are gone in post_clear.
+        instance._cleared_course_ids = list(instance.course_joined.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action != 'post_clear' and not pk_set:
+        return      # nothing was added/removed (e.g. the user was already enrolled)
+
+    if reverse:
+        # instance is a User, pk_set holds course ids
+        course_ids = getattr(instance, '_cleared_course_ids', []) if action == 'post_clear' else pk_set
+    else:
+        # instance is a Course, pk_set holds user ids
+        course_ids = [instance.pk]
+
+    # The counters at once (the pages of the request show them), the rankings on commit.
+    courses = Course.objects.filter(pk__in=course_ids)
+    courses.refresh_counters(['total_students'])
+    refresh_popular_courses(*courses.values_list('subject_id', flat=True).distinct())
+
+
+# Search index
+# Documents are updated one by one as the objects are saved, so the index never needs
+# a full rebuild ('manage.py rebuild_search_index' exists for repairs).
+
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, **kwargs):
+    get_backend().index('course', instance.pk, instance.pk, instance.title, instance.overview)
+
+
+@receiver(post_save, sender=Module)
+def index_module(sender, instance, **kwargs):
+    get_backend().index('module', instance.pk, instance.course_id, instance.title, instance.description)
+
+
+def index_text(text, course_id=None):
+    if course_id is None:
+        # Course of the module the text was added to (none yet right after creating the text:
+        # it's indexed when its Content is created).
+        course_id = Content.objects.filter(
+            content_type=ContentType.objects.get_for_model(Text), object_id=text.pk
+        ).values_list('module__course_id', flat=True).first()
+    if course_id is not None:
+        get_backend().index('text', text.pk, course_id, text.title, text.content)
+
+
+@receiver(post_save, sender=Text)
+def text_saved(sender, instance, **kwargs):
+    index_text(instance)
+
+
+@receiver(post_save, sender=Content)
+def content_saved(sender, instance, created, **kwargs):
+    if created and instance.content_type_id == ContentType.objects.get_for_model(Text).id:
+        index_text(instance.item, course_id=instance.module.course_id)
+
+
+@receiver(post_delete, sender=Course)
+def unindex_course(sender, instance, **kwargs):
+    get_backend().remove('course', instance.pk)
+
+
+@receiver(post_delete, sender=Module)
+def unindex_module(sender, instance, **kwargs):
+    get_backend().remove('module', instance.pk)
+
+
+@receiver(post_delete, sender=Content)
+def content_deleted(sender, instance, **kwargs):
+    # Texts are not deleted with their module/course (generic relation): drop them from the index.
+    if instance.content_type_id == ContentType.objects.get_for_model(Text).id:
+        get_backend().remove('text', instance.object_id)
+
+
+@receiver(post_delete, sender=Text)
+def unindex_text(sender, instance, **kwargs):
+    get_backend().remove('text', instance.pk)
+
+
+# Content-addressed files (courses/storage.py)
+# A blob is freed when the last File/Image using it is deleted or gets another file.
+
+@receiver(pre_save, sender=File)
+@receiver(pre_save, sender=Image)
+def remember_previous_file(sender, instance, **kwargs):
+    instance._previous_file = None
+    if instance.pk:
+        instance._previous_file = sender.objects.filter(
+            pk=instance.pk
+        ).values_list('file', flat=True).first()
+
+
+@receiver(post_save, sender=File)
+@receiver(post_save, sender=Image)
+def file_replaced(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_file', None)
+    if previous and previous != instance.file.name:
+        release_blob(previous)
+
+
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance, **kwargs):
+    # Responsive variants (courses/derivatives.py), generated after the commit: the worker
+    # thread reads the image with its own database connection.
+    if settings.IMAGE_DERIVATIVE_WORKERS and instance.file and not instance.derivatives:
+        transaction.on_commit(lambda: queue_derivatives(instance.pk))
+
+
+@receiver(post_delete, sender=File)
+@receiver(post_delete, sender=Image)
+def file_deleted(sender, instance, **kwargs):
+    release_blob(instance.file.name)
+
+
+@receiver(post_delete, sender=UploadSession)
+def upload_session_deleted(sender, instance, **kwargs):
+    # completed (the part file was moved into the storage), abandoned or expired
+    if os.path.exists(instance.part_path):
+        os.remove(instance.part_path)
+
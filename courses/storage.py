@@ -0,0 +1,130 @@
+import hashlib
+import os
+import tempfile
+from django.apps import apps
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+
+# Content-addressed storage for File and Image items
+# An uploaded file is hashed (sha256) while it is written, and stored under its digest:
+#     blobs/3f/a2/3fa2...e1.pdf
+# Uploading the same slide deck to 40 courses stores it once: the 40 items point to the same
+# blob. A blob is deleted when the last File/Image using it is deleted (or gets another file),
+# see release_blob(). Files uploaded before (files/..., images/...) are left as they are.
+#
+# Storing a blob and releasing it are serialized on its name with a row lock (lock_blob()):
+# store() takes the lock in the transaction saving the File/Image, so the lock is held until the
+# new reference is committed, and release() counts the references while holding it. Without it,
+# a release could count the references, then delete the file that a concurrent upload of the
+# same content found on disk and referenced.
+
+BLOB_PREFIX = 'blobs'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    chunk_size = 64 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        # No '_<random>' suffix: the final name is derived from the content in _save(),
+        # and a blob that already exists is the same file.
+        return name
+
+    def blob_name(self, digest, name):
+        extension = os.path.splitext(name)[1].lower()
+        return f'{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk (large form uploads, resumable uploads): hash it, then move it.
+            path = content.temporary_file_path()
+            with open(path, 'rb') as f:
+                while chunk := f.read(self.chunk_size):
+                    digest.update(chunk)
+            return self.store(path, digest.hexdigest(), name, move=file_move_safe)
+
+        # Written to a temporary file next to the blobs while hashing, in chunks.
+        temp_dir = self.path(f'{BLOB_PREFIX}/tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks(self.chunk_size):
+                    digest.update(chunk)
+                    f.write(chunk)
+            return self.store(path, digest.hexdigest(), name, move=os.replace)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def store(self, path, digest, name, move):
+        blob = self.blob_name(digest, name)
+        # Savepoint inside the transaction of the item being saved (the lock is kept until it commits).
+        with transaction.atomic():
+            lock_blob(blob)
+            if self.exists(blob):
+                return blob     # duplicate: nothing to store
+            os.makedirs(os.path.dirname(self.path(blob)), exist_ok=True)
+            try:
+                # Two concurrent uploads of the same content write the same file.
+                move(path, self.path(blob))
+            except FileExistsError:
+                return blob
+            if self.file_permissions_mode is not None:
+                os.chmod(self.path(blob), self.file_permissions_mode)
+            return blob
+
+
+blob_storage = ContentAddressedStorage()
+
+
+class LocalFile(File):
+    # A file already on disk (e.g. an assembled resumable upload): the storage moves it
+    # instead of copying it.
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(f'{BLOB_PREFIX}/')
+
+
+def lock_blob(name):
+    # Locks the BlobLock row of the blob until the end of the current transaction.
+    BlobLock = apps.get_model('courses', 'BlobLock')
+    return BlobLock.objects.select_for_update().get_or_create(name=name)[0]
+
+
+def blob_references(name):
+    # Number of items using the blob (reference count).
+    return sum(
+        apps.get_model('courses', model_name).objects.filter(file=name).count()
+        for model_name in ('File', 'Image')
+    )
+
+
+def release_blob(name):
+    """
+    Deletes the blob `name` once the current transaction is committed, if no File/Image
+    references it anymore.
+    """
+    if not is_blob(name):
+        return
+
+    def release():
+        with transaction.atomic():
+            # Waits for the transactions storing the same content: their references count.
+            lock = lock_blob(name)
+            if blob_references(name):
+                return
+            from .derivatives import delete_derivatives     # here: it imports the models
+            blob_storage.delete(name)
+            delete_derivatives(name)
+            lock.delete()
+
+    transaction.on_commit(release)
@@ -1,3 +1,1366 @@
-from django.test import TestCase
+import json
+import math
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from educa import metrics
+from educa import cache as two_tier
+from educa.cache import MISSING, LocalTier, TwoTierRedisCache
+from PIL import Image as PILImage
+from . import benchmark, views
+from .caching import (
+    course_structure_family, get_version, module_contents_family, subject_courses_family
+)
+from .catalog import module_contents_key, warm
+from .derivatives import generate_derivatives
+from .search import get_backend
+from .views import CourseListView
+from .models import BlobLock, Content, Course, OrderCounter, File, Image, Module, Subject, Text, UploadSession, Video
 
-# Create your tests here.
+
+# Tests don't need the Redis service: use an in-process cache.
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+
+def create_course(username='instructor', slug='course'):
+    owner = User.objects.create_user(username, password='password')
+    subject = Subject.objects.create(title=f'Subject {slug}', slug=f'subject-{slug}')
+    return Course.objects.create(
+        owner=owner, subject=subject, title=f'Course {slug}', slug=slug, overview='Overview'
+    )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class OrderFieldTests(TestCase):
+    def setUp(self):
+        self.course = create_course()
+
+    def test_orders_are_consecutive_per_parent(self):
+        modules = [Module.objects.create(course=self.course, title=f'M{i}') for i in range(3)]
+        other = Module.objects.create(course=create_course('other', 'other'), title='Other')
+        self.assertEqual([m.order for m in modules], [0, 1, 2])
+        self.assertEqual(other.order, 0)
+
+    def test_counter_starts_after_existing_rows(self):
+        Module.objects.create(course=self.course, title='M0', order=7)
+        self.assertEqual(Module.objects.create(course=self.course, title='M1').order, 8)
+
+    def test_explicit_order_is_kept(self):
+        self.assertEqual(Module.objects.create(course=self.course, title='M', order=5).order, 5)
+
+    def test_explicit_orders_advance_the_counter(self):
+        Module.objects.create(course=self.course, title='M0')      # creates the counter
+        Module.objects.create(course=self.course, title='M5', order=5)
+        self.assertEqual(Module.objects.create(course=self.course, title='M6').order, 6)
+        Module.objects.bulk_create([Module(course=self.course, title='M9', order=9)])
+        self.assertEqual(Module.objects.create(course=self.course, title='M10').order, 10)
+        module = Module.objects.create(course=self.course, title='M11')
+        module.order = 20
+        module.save()
+        self.assertEqual(Module.objects.create(course=self.course, title='M21').order, 21)
+
+    def test_counters_are_deleted_with_their_parent(self):
+        module = Module.objects.create(course=self.course, title='M')
+        text = Text.objects.create(owner=self.course.owner, title='T', content='...')
+        Content.objects.create(module=module, item=text)
+        self.assertEqual(OrderCounter.objects.count(), 2)
+        self.course.delete()
+        self.assertFalse(OrderCounter.objects.exists())
+
+    def test_bulk_create_allocates_once_per_parent(self):
+        Module.objects.create(course=self.course, title='M0')
+        module = Module.objects.create(course=self.course, title='M1')
+        texts = [
+            Text.objects.create(owner=self.course.owner, title=f'T{i}', content='...') for i in range(4)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            Module.objects.bulk_create(
+                [Module(course=self.course, title=f'New {i}') for i in range(3)]
+            )
+            Content.objects.bulk_create([Content(module=module, item=text) for text in texts])
+        # a single counter UPDATE per parent, not one per row
+        counter_updates = [
+            q for q in queries.captured_queries
+            if q['sql'].startswith('UPDATE "courses_ordercounter"')
+        ]
+        self.assertEqual(len(counter_updates), 2)
+        self.assertEqual(
+            list(self.course.modules.values_list('order', flat=True)), [0, 1, 2, 3, 4]
+        )
+        self.assertEqual(list(module.contents.values_list('order', flat=True)), [0, 1, 2, 3])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class OrderFieldConcurrencyTests(TransactionTestCase):
+    writers = 8
+    modules_per_writer = 10
+
+    def test_concurrent_writers_get_distinct_orders(self):
+        course = create_course()
+        barrier = threading.Barrier(self.writers)
+        errors = []
+
+        def write(writer):
+            try:
+                barrier.wait()      # start all the writers at the same time
+                for i in range(self.modules_per_writer):
+                    Module.objects.create(course=course, title=f'{writer}.{i}')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        orders = sorted(course.modules.values_list('order', flat=True))
+        self.assertEqual(orders, list(range(self.writers * self.modules_per_writer)))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class OrderUpdateTests(TestCase):
+    def setUp(self):
+        self.course = create_course()
+        self.modules = [Module.objects.create(course=self.course, title=f'M{i}') for i in range(3)]
+        self.client.login(username='instructor', password='password')
+
+    def reorder(self, orders):
+        return self.client.post(
+            reverse('module_order'), json.dumps(orders), content_type='application/json'
+        )
+
+    def module_updates(self, queries):
+        return [
+            q['sql'] for q in queries
+            if q['sql'].startswith('UPDATE "courses_module"')
+        ]
+
+    def test_reorder_updates_the_changed_rows_in_one_query(self):
+        m0, m1, m2 = self.modules
+        with CaptureQueriesContext(connection) as queries:
+            response = self.reorder({m0.id: 2, m1.id: 1, m2.id: 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 2)     # m1 keeps its order
+        self.assertEqual(len(self.module_updates(queries)), 1)
+        self.assertEqual(
+            list(self.course.modules.values_list('id', flat=True)), [m2.id, m1.id, m0.id]
+        )
+        # The allocation counter was moved past the new orders.
+        self.assertEqual(Module.objects.create(course=self.course, title='M3').order, 3)
+
+    def test_reorder_query_count(self):
+        m0, m1, m2 = self.modules
+        # session + user, siblings, savepoint, counter, one UPDATE, release, Course.touch()
+        # (the structure version is bumped in the cache)
+        with self.assertNumQueries(8):
+            response = self.reorder({m0.id: 1, m1.id: 0, m2.id: 2})
+        self.assertEqual(response.status_code, 200)
+
+    def test_reorder_is_batched(self):
+        m0, m1, m2 = self.modules
+        with mock.patch.object(views.ModuleOrderView, 'batch_size', 2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.reorder({m0.id: 2, m1.id: 0, m2.id: 1})
+        self.assertEqual(response.json()['updated'], 3)
+        self.assertEqual(len(self.module_updates(queries)), 2)
+
+    def test_unchanged_orders_update_nothing(self):
+        m0, m1, m2 = self.modules
+        with CaptureQueriesContext(connection) as queries:
+            response = self.reorder({m0.id: 0, m1.id: 1, m2.id: 2})
+        self.assertEqual(response.json()['updated'], 0)
+        self.assertEqual(self.module_updates(queries), [])
+
+    def test_invalid_payloads_are_rejected(self):
+        m0, m1, m2 = self.modules
+        for payload in ([m0.id], {}, {m0.id: 'first'}, {m0.id: -1, m1.id: 0, m2.id: 1}):
+            with self.subTest(payload=payload):
+                self.assertEqual(self.reorder(payload).status_code, 400)
+
+    def test_unknown_ids_are_rejected(self):
+        m0, m1, m2 = self.modules
+        response = self.reorder({m0.id: 0, m1.id: 1, m2.id: 2, 9999: 3})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['ids'], [9999])
+
+    def test_modules_of_another_owner_are_unknown(self):
+        other = Module.objects.create(course=create_course('other', 'other'), title='Other')
+        response = self.reorder({other.id: 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['ids'], [other.id])
+        self.assertEqual(Module.objects.get(id=other.id).order, 0)
+
+    def test_mixed_parents_are_rejected(self):
+        second = Course.objects.create(
+            owner=self.course.owner, subject=self.course.subject, title='Second', slug='second',
+            overview='Overview'
+        )
+        other = Module.objects.create(course=second, title='Other')
+        orders = {m.id: m.order for m in self.modules} | {other.id: 3}
+        response = self.reorder(orders)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('same course', response.json()['errors'][0])
+
+    def test_partial_orders_are_rejected(self):
+        m0, m1, m2 = self.modules
+        response = self.reorder({m0.id: 1, m1.id: 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['ids'], [m2.id])
+        self.assertEqual(Module.objects.get(id=m0.id).order, 0)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CatalogCacheTests(TestCase):
+    # The writes bump the version of the key families they affect (courses/signals.py):
+    # the cached catalog entries built before them are not read anymore.
+    def setUp(self):
+        cache.clear()
+        self.course = create_course()
+        self.subject = self.course.subject
+        self.other_subject = Subject.objects.create(title='Other', slug='other')
+        self.entries = {
+            'all_subjects': 'catalog:subjects',
+            'all_courses': 'catalog:courses',
+            f'subject_{self.subject.pk}_courses': subject_courses_family(self.subject.pk),
+            f'subject_{self.other_subject.pk}_courses': subject_courses_family(self.other_subject.pk),
+        }
+        for subject in (self.subject, self.other_subject):
+            self.client.get(reverse('course_list_subject', args=[subject.slug]))
+        self.client.get(reverse('course_list'))
+        self.assertEqual(self.cached(), set(self.entries))
+
+    def cached(self):
+        return {
+            key for key, family in self.entries.items()
+            if cache.get(key, version=get_version(family)) is not None
+        }
+
+    def test_subject_changes(self):
+        self.subject.title = 'Renamed'
+        self.subject.save()
+        self.assertEqual(self.cached(), {f'subject_{self.other_subject.pk}_courses'})
+        self.client.get(reverse('course_list'))
+        self.other_subject.delete()
+        self.assertNotIn('all_subjects', self.cached())
+
+    def test_course_changes(self):
+        structure = get_version(course_structure_family(self.course.pk))
+        self.course.title = 'Renamed'
+        self.course.save()
+        self.assertEqual(self.cached(), {f'subject_{self.other_subject.pk}_courses'})
+        self.assertNotEqual(get_version(course_structure_family(self.course.pk)), structure)
+
+        # moved to another subject: both subject lists change
+        self.client.get(reverse('course_list_subject', args=[self.subject.slug]))
+        self.course.subject = self.other_subject
+        self.course.save()
+        self.assertEqual(self.cached(), set())
+
+    def test_course_deletion(self):
+        self.course.delete()
+        self.assertEqual(self.cached(), {f'subject_{self.other_subject.pk}_courses'})
+
+    def test_module_changes(self):
+        for write in (
+            lambda: Module.objects.create(course=self.course, title='Module'),
+            lambda: Module.objects.get(course=self.course).save(),
+            lambda: Module.objects.get(course=self.course).delete(),
+        ):
+            for subject in (self.subject, self.other_subject):
+                self.client.get(reverse('course_list_subject', args=[subject.slug]))
+            self.client.get(reverse('course_list'))
+            structure = get_version(course_structure_family(self.course.pk))
+            write()
+            # total_modules is shown in the course lists, not in the subject list
+            self.assertEqual(
+                self.cached(), {'all_subjects', f'subject_{self.other_subject.pk}_courses'}
+            )
+            self.assertNotEqual(get_version(course_structure_family(self.course.pk)), structure)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class QueryBudgetTests(TestCase):
+    # The query budgets of the views (courses/benchmark.py) must hold whatever the size of
+    # the catalog; 'manage.py benchmark_views' runs the same checks on a bigger catalog.
+    def test_views_stay_within_query_budgets(self):
+        report = benchmark.run(
+            repeat=1, subjects=2, courses=3, modules=3, contents=8, students=5
+        )
+        for name, result in report['results'].items():
+            with self.subTest(view=name):
+                self.assertEqual(result['status'], 200)
+                self.assertLessEqual(result['queries'], result['budget'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StoredRenderTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('instructor')
+        self.texts = [
+            Text.objects.create(owner=owner, title=f'Text {i}', content=f'Content {i}') for i in range(3)
+        ]
+
+    def test_stored_html_is_served(self):
+        text = Text.objects.get(pk=self.texts[0].pk)
+        self.assertIn('Content 0', text.rendered)
+        with mock.patch.object(Text, 'render_html') as render_html, self.assertNumQueries(0):
+            self.assertEqual(text.render(), text.rendered)
+        render_html.assert_not_called()
+
+    def test_render_is_refreshed_when_the_template_changes(self):
+        text = Text.objects.get(pk=self.texts[0].pk)
+        with mock.patch('courses.models.template_fingerprint', return_value='new-template'), \
+                mock.patch.object(Text, 'render_html', return_value='<p>New template</p>'):
+            self.assertEqual(text.render(), '<p>New template</p>')
+            # stored: the next load doesn't render again
+            text = Text.objects.get(pk=text.pk)
+            self.assertEqual(text.rendered_key, 'new-template')
+            self.assertEqual(text.render(), '<p>New template</p>')
+            self.assertEqual(Text.render_html.call_count, 1)
+
+    def test_rebuild_skips_current_rows(self):
+        stale = self.texts[1]
+        Text.objects.filter(pk=stale.pk).update(rendered='old', rendered_key='old-template')
+        out = StringIO()
+        with mock.patch.object(Text, 'render_html', return_value='<p>Rebuilt</p>') as render_html:
+            call_command('rebuild_renders', '--model', 'text', '--stale-only', stdout=out)
+        self.assertEqual(render_html.call_count, 1)
+        self.assertIn('text: 1 item(s) re-rendered', out.getvalue())
+        self.assertEqual(
+            dict(Text.objects.values_list('pk', 'rendered')),
+            {
+                self.texts[0].pk: self.texts[0].rendered,
+                stale.pk: '<p>Rebuilt</p>',
+                self.texts[2].pk: self.texts[2].rendered,
+            }
+        )
+
+    def test_rebuild_renders_everything_by_default(self):
+        out = StringIO()
+        call_command('rebuild_renders', '--model', 'text', '--batch-size', '2', stdout=out)
+        self.assertIn('text: 3 item(s) re-rendered', out.getvalue())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ExportTests(TestCase):
+    def setUp(self):
+        self.course = create_course()
+        module = Module.objects.create(course=self.course, title='Module')
+        text = Text.objects.create(owner=self.course.owner, title='Text', content='Hello')
+        Content.objects.create(module=module, item=text)
+        self.staff = User.objects.create_user('staff', password='password', is_staff=True)
+
+    def export(self, url):
+        self.client.force_login(self.staff)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_course_export_streams_json_lines(self):
+        lines = self.export(reverse('api:course-export', args=[self.course.pk]))
+        self.assertEqual(
+            [line['type'] for line in lines], ['subject', 'course', 'module', 'content']
+        )
+        self.assertEqual(lines[-1]['item']['type'], 'text')
+        self.assertEqual(lines[-1]['item']['content'], 'Hello')
+
+    def test_catalog_export_requires_staff(self):
+        self.client.force_login(self.course.owner)
+        response = self.client.get(reverse('api:course-export-all'))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MetricsTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(metrics, 'registry', metrics.MetricsRegistry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.course = create_course()
+        Module.objects.create(course=self.course, title='Module')
+        self.staff = User.objects.create_user('staff', is_staff=True)
+
+    def test_histogram_buckets(self):
+        histogram = metrics.Histogram((1, 10, 100))
+        for value in (0.5, 1, 5, 50, 50, 500):
+            histogram.record(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(
+            snapshot['buckets'], {'le_1': 2, 'le_10': 1, 'le_100': 2, 'overflow': 1}
+        )
+        self.assertEqual((snapshot['p50'], snapshot['p95']), (10, math.inf))
+        self.assertEqual(snapshot['sum'], 606.5)
+
+    def test_metrics_are_staff_only(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 302)     # to the admin login
+        self.client.force_login(self.course.owner)
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_requests_are_recorded_per_view(self):
+        for _ in range(2):
+            response = self.client.get(reverse('api:course-detail', args=[self.course.pk]))
+        self.client.force_login(self.staff)
+        snapshot = self.client.get(reverse('metrics')).json()['api:course-detail']
+        self.assertEqual(snapshot['requests'], 2)
+        for histogram in ('latency_ms', 'queries', 'sql_ms', 'body_bytes'):
+            self.assertEqual(sum(snapshot[histogram]['buckets'].values()), 2)
+        self.assertEqual(snapshot['body_bytes']['sum'], 2 * len(response.content))
+        self.assertGreater(snapshot['queries']['sum'], 0)
+
+    def test_streaming_responses_are_recorded_when_the_stream_ends(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('api:course-export', args=[self.course.pk]))
+        self.assertNotIn('api:course-export', self.registry.snapshot())
+        body = b''.join(response.streaming_content)
+        snapshot = self.registry.snapshot()['api:course-export']
+        self.assertEqual(snapshot['requests'], 1)
+        self.assertEqual(snapshot['body_bytes']['sum'], len(body))
+        # the export queries run while the body is produced: at least the course, its modules
+        # and its contents
+        self.assertGreaterEqual(snapshot['queries']['sum'], 3)
+
+    async def test_async_streaming_responses_are_recorded_when_the_stream_ends(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(reverse('api:course-export', args=[self.course.pk]))
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        snapshot = self.registry.snapshot()['api:course-export']
+        self.assertEqual(snapshot['body_bytes']['sum'], len(body))
+        self.assertGreaterEqual(snapshot['queries']['sum'], 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AsyncViewTests(TestCase):
+    # The catalog and API read views are async; served through the ASGI handler here.
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):      # popular courses ranking
+            self.course = create_course()
+        Module.objects.create(course=self.course, title='Module')
+
+    async def test_read_views_under_asgi(self):
+        urls = [
+            reverse('course_list'),
+            reverse('course_list_subject', args=[self.course.subject.slug]),
+            reverse('course_detail', args=[self.course.slug]),
+            reverse('api:course-list'),
+            reverse('api:course-detail', args=[self.course.pk]),
+            reverse('api:subject-list'),
+            reverse('api:subject-detail', args=[self.course.subject_id]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, self.course.title)
+        response = await self.async_client.get(reverse('api:course-detail', args=['abc']))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.course = create_course()
+        self.module = Module.objects.create(course=self.course, title='Module')
+
+    def test_unchanged_course_answers_304(self):
+        url = reverse('api:course-detail', args=[self.course.pk])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):      # the `updated` lookup only
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # a module change is a change of the course
+        self.module.title = 'Renamed'
+        self.module.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Renamed')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_etag_follows_the_objects(self):
+        for url in (reverse('api:course-list'), reverse('api:subject-list')):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+                course = create_course(username=f'other-{url}', slug=f'other-{len(url)}')
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                course.delete()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CatalogPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.course = create_course()
+        for i in range(6):
+            Course.objects.create(
+                owner=self.course.owner, subject=self.course.subject, title=f'Course {i}',
+                slug=f'course-{i}', overview='Overview'
+            )
+        self.url = reverse('api:course-list')
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def count_queries(self, queries):
+        # (not the COUNT()/MAX() of the ETag, courses/api/views.py)
+        return [q for q in queries if 'COUNT(*)' in q['sql']]
+
+    def test_page_numbers_by_default(self):
+        page = self.get(self.url, page_size=5)
+        self.assertEqual(page['count'], 7)
+        self.assertIn('page=2', page['next'])
+        self.assertEqual(len(page['results']), 5)
+
+    def test_cursor_pages(self):
+        page = self.get(self.url, pagination='cursor', page_size=3)
+        self.assertNotIn('count', page)
+        self.assertIsNone(page['previous'])
+        ids = [c['id'] for c in page['results']]
+        pages = [ids]
+        while page['next']:
+            self.assertIn('cursor=', page['next'])
+            page = self.get(page['next'])
+            pages.append([c['id'] for c in page['results']])
+            ids += pages[-1]
+        self.assertEqual(
+            ids, list(Course.objects.order_by('-created', '-id').values_list('id', flat=True))
+        )
+        self.assertEqual(len(pages), 3)
+
+        # back from the last page
+        previous = self.get(page['previous'])
+        self.assertEqual([c['id'] for c in previous['results']], pages[1])
+
+    def test_cursor_pages_are_stable_when_courses_are_added(self):
+        first = self.get(self.url, pagination='cursor', page_size=3)
+        Course.objects.create(
+            owner=self.course.owner, subject=self.course.subject, title='New', slug='new',
+            overview='Overview'
+        )
+        second = self.get(first['next'])
+        expected = Course.objects.order_by('-created', '-id').values_list('id', flat=True)
+        self.assertEqual([c['id'] for c in second['results']], list(expected[4:7]))
+
+    def test_count_is_cached_and_invalidated(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(self.url, pagination='cursor', count='true')['count'], 7)
+        self.assertEqual(len(self.count_queries(queries)), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(self.url, pagination='cursor', count='1')['count'], 7)
+        self.assertEqual(self.count_queries(queries), [])
+
+        self.course.delete()
+        self.assertEqual(self.get(self.url, pagination='cursor', count='true')['count'], 6)
+
+    def test_subject_cursor_pages(self):
+        Subject.objects.create(title='Another subject', slug='another')
+        page = self.get(reverse('api:subject-list'), pagination='cursor', page_size=1, count='true')
+        self.assertEqual(page['count'], 2)
+        self.assertEqual(page['results'][0]['title'], 'Another subject')
+        page = self.get(page['next'])
+        self.assertEqual(page['results'][0]['title'], self.course.subject.title)
+        self.assertIsNone(page['next'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.course = create_course()
+        Module.objects.create(course=self.course, title='Module')
+
+    def test_fields_and_expand(self):
+        url = reverse('api:course-list')
+        default = self.client.get(url).json()['results'][0]
+        self.assertEqual(default['modules'][0]['title'], 'Module')
+
+        with self.assertNumQueries(3):      # ETag lookup, count, page: no modules query
+            response = self.client.get(url, {'fields': 'id,title'})
+        self.assertEqual(response.json()['results'], [{'id': self.course.id, 'title': self.course.title}])
+
+        response = self.client.get(url, {'fields': 'id', 'expand': 'modules'})
+        self.assertEqual(response.json()['results'][0], {'id': self.course.id, 'modules': default['modules']})
+
+        response = self.client.get(reverse('api:course-detail', args=[self.course.pk]), {'fields': 'slug'})
+        self.assertEqual(response.json(), {'slug': self.course.slug})
+        self.assertEqual(self.client.get(url, {'fields': 'id,students'}).status_code, 400)
+
+    def test_empty_fields_are_rejected(self):
+        for fields in ('', ',', ',,'):
+            with self.subTest(fields=fields):
+                for url in (reverse('api:course-list'), reverse('api:course-detail', args=[self.course.pk])):
+                    response = self.client.get(url, {'fields': fields, 'expand': 'modules'})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('fields', response.json())
+
+    def test_fields_with_cursor_pages(self):
+        # The cursor needs the ordering columns (created, id for courses; title, id for
+        # subjects) even when ?fields= doesn't output them.
+        for i in range(4):
+            Course.objects.create(
+                owner=self.course.owner, subject=self.course.subject, title=f'Course {i}',
+                slug=f'course-{i}', overview='Overview'
+            )
+        expected = list(Course.objects.order_by('-created', '-id').values_list('title', flat=True))
+        for fields in ('title', 'id,title'):
+            with self.subTest(fields=fields):
+                titles = []
+                url, params = reverse('api:course-list'), {
+                    'pagination': 'cursor', 'fields': fields, 'page_size': 2
+                }
+                while url:
+                    response = self.client.get(url, params)
+                    self.assertEqual(response.status_code, 200)
+                    page = response.json()
+                    for course in page['results']:
+                        self.assertEqual(set(course), set(fields.split(',')))
+                        titles.append(course['title'])
+                    url, params = page['next'], {}
+                self.assertEqual(titles, expected)
+
+        Subject.objects.create(title='Another subject', slug='another')
+        page = self.client.get(
+            reverse('api:subject-list'), {'pagination': 'cursor', 'page_size': 1}
+        ).json()
+        self.assertEqual(self.client.get(page['next']).status_code, 200)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ValuesSerializationTests(TestCase):
+    def test_values_rows_give_the_same_output(self):
+        benchmark.seed_catalog(subjects=2, courses=3, modules=2, contents=0, students=2)
+        for name, (serializer_class, queryset) in benchmark.serialization_paths().items():
+            with self.subTest(endpoint=name):
+                self.assertEqual(
+                    json.dumps(benchmark.serialize_values(serializer_class, queryset)),
+                    json.dumps(benchmark.serialize_instances(serializer_class, queryset)),
+                )
+
+        # through the API, cursor pagination and sparse fields included
+        response = self.client.get(reverse('api:course-list'), {'pagination': 'cursor', 'page_size': 2})
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertIsNotNone(response.json()['next'])
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(len(response.json()['results']), 2)
+        response = self.client.get(reverse('api:course-list'), {'fields': 'title', 'expand': 'modules'})
+        self.assertEqual(set(response.json()['results'][0]), {'title', 'modules'})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CourseCounterTests(TestCase):
+    def setUp(self):
+        self.course = create_course()
+        self.student = User.objects.create_user('student')
+
+    def counters(self):
+        self.course.refresh_from_db()
+        return self.course.total_modules, self.course.total_students
+
+    def test_modules_are_counted(self):
+        first = Module.objects.create(course=self.course, title='First')
+        Module.objects.create(course=self.course, title='Second')
+        self.assertEqual(self.counters(), (2, 0))
+        first.title = 'Renamed'
+        first.save()
+        self.assertEqual(self.counters(), (2, 0))
+        first.delete()
+        self.assertEqual(self.counters(), (1, 0))
+
+    def test_enrollments_are_counted(self):
+        other = User.objects.create_user('other')
+        self.course.students.add(self.student, other)
+        self.assertEqual(self.counters(), (0, 2))
+        self.course.students.remove(other)
+        self.assertEqual(self.counters(), (0, 1))
+        self.student.course_joined.clear()
+        self.assertEqual(self.counters(), (0, 0))
+        self.student.course_joined.add(self.course)
+        self.assertEqual(self.counters(), (0, 1))
+
+    def test_stale_instance_does_not_write_back_counters(self):
+        stale = Course.objects.get(pk=self.course.pk)
+        self.course.students.add(self.student)
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertEqual(self.counters(), (0, 1))
+
+    def test_drift_is_detected_and_repaired(self):
+        Module.objects.create(course=self.course, title='Module')
+        self.course.students.add(self.student)
+        self.assertFalse(Course.objects.with_counter_drift().exists())
+
+        # e.g. rows written with update()/raw SQL, which send no signals
+        Course.objects.filter(pk=self.course.pk).update(total_modules=5, total_students=4)
+        Subject.objects.refresh_popular_courses()
+        self.assertEqual(list(Course.objects.with_counter_drift()), [self.course])
+
+        out = StringIO()
+        call_command('reconcile_course_counters', '--dry-run', stdout=out)
+        self.assertIn('1 course(s) with wrong counters', out.getvalue())
+        self.assertEqual(self.counters(), (5, 4))
+
+        call_command('reconcile_course_counters', stdout=StringIO())
+        self.assertEqual(self.counters(), (1, 1))
+        self.assertFalse(Course.objects.with_counter_drift().exists())
+        ranking = Subject.objects.get(pk=self.course.subject_id).popular_courses
+        self.assertEqual(ranking[0]['total_students'], 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PopularCoursesTests(TestCase):
+    def setUp(self):
+        self.subject = Subject.objects.create(title='Subject', slug='subject')
+        owner = User.objects.create_user('instructor')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.courses = [
+                Course.objects.create(
+                    owner=owner, subject=self.subject, title=f'Course {i}', slug=f'course-{i}',
+                    overview='Overview'
+                )
+                for i in range(Subject.POPULAR_COURSES + 1)
+            ]
+        self.students = [User.objects.create_user(f'student{i}') for i in range(3)]
+
+    def ranking(self):
+        return [c['id'] for c in Subject.objects.get(pk=self.subject.pk).popular_courses]
+
+    def test_most_enrolled_first_and_truncated(self):
+        first, second, third, fourth = self.courses
+        # ties: the most recent course first
+        self.assertEqual(self.ranking(), [fourth.pk, third.pk, second.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            first.students.add(*self.students)
+            second.students.add(self.students[0])
+        self.assertEqual(self.ranking(), [first.pk, second.pk, fourth.pk])
+        self.assertEqual(
+            Subject.objects.get(pk=self.subject.pk).popular_courses[0],
+            {'id': first.pk, 'title': first.title, 'total_students': 3}
+        )
+
+    def test_refreshed_on_unenrollment_and_course_changes(self):
+        first, second, third, fourth = self.courses
+        with self.captureOnCommitCallbacks(execute=True):
+            first.students.add(self.students[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.students[0].course_joined.remove(first)
+        self.assertEqual(self.ranking(), [fourth.pk, third.pk, second.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            fourth.delete()
+        self.assertEqual(self.ranking(), [third.pk, second.pk, first.pk])
+
+    def test_refreshed_once_per_transaction(self):
+        first = self.courses[0]
+        with self.captureOnCommitCallbacks() as callbacks:
+            for student in self.students:
+                first.students.add(student)
+        self.assertEqual(self.ranking()[0], self.courses[-1].pk)     # not refreshed yet
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        rankings = [q for q in queries if q['sql'].startswith('UPDATE "courses_subject"')]
+        self.assertEqual(len(rankings), 1)
+        self.assertEqual(self.ranking()[0], first.pk)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BulkEnrollTests(TestCase):
+    def setUp(self):
+        self.course = create_course()
+        self.second = Course.objects.create(
+            owner=self.course.owner, subject=self.course.subject, title='Second', slug='second',
+            overview='Overview'
+        )
+        self.users = [User.objects.create_user(f'student{i}') for i in range(3)]
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+    def post(self, enrollments):
+        return self.client.post(
+            reverse('api:bulk_enroll'), {'enrollments': enrollments}, content_type='application/json'
+        )
+
+    def enroll(self, pairs):
+        return self.post([{'course': course.pk, 'user': user.pk} for course, user in pairs])
+
+    def test_staff_only(self):
+        self.client.force_login(self.users[0])
+        response = self.enroll([(self.course, self.users[0])])
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(self.course.students.exists())
+
+    def test_duplicates_and_existing_enrollments(self):
+        a, b, c = self.users
+        self.course.students.add(a)
+        response = self.enroll([(self.course, a), (self.course, b), (self.course, b), (self.second, c)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'attempted': 2, 'existing': 1})
+        self.assertEqual(set(self.course.students.all()), {a, b})
+
+    def test_unknown_users_and_courses(self):
+        response = self.post([{'course': self.course.pk, 'user': 9999}, {'course': 9998, 'user': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unknown users: [9999]', str(response.json()))
+        self.assertIn('Unknown courses: [9998]', str(response.json()))
+        self.assertFalse(Course.students.through.objects.exists())
+
+    def test_counters_and_popular_courses_are_refreshed(self):
+        a, b, c = self.users
+        self.enroll([(self.second, a), (self.second, b), (self.course, c)])
+        self.course.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.course.total_students, self.second.total_students), (1, 2))
+        self.assertFalse(Course.objects.with_counter_drift().exists())
+        ranking = Subject.objects.get(pk=self.course.subject_id).popular_courses
+        self.assertEqual(
+            [(c['id'], c['total_students']) for c in ranking],
+            [(self.second.pk, 2), (self.course.pk, 1)]
+        )
+
+
+@override_settings(CACHES=TEST_CACHES, DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    # 'replica' mirrors the test database of 'default': a second connection to the same data.
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.course = create_course()
+        self.student = User.objects.create_user('student', password='password')
+
+    def get(self, url):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(primary.captured_queries), len(replica.captured_queries)
+
+    def test_reads_go_to_the_replica_until_the_user_writes(self):
+        url = reverse('api:course-detail', args=[self.course.pk])
+        primary, replica = self.get(url)
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+        self.assertEqual(Course.objects.db_manager().db, 'default')     # outside of requests
+
+        self.client.force_login(self.student)
+        response = self.client.post(reverse('student_enroll_course'), {'course': self.course.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('primary_db', response.cookies)
+        self.assertTrue(self.course.students.filter(pk=self.student.pk).exists())
+
+        # pinned by the cookie: the student sees the enrollment they just made
+        primary, replica = self.get(reverse('student_course_detail', args=[self.course.pk]))
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        del self.client.cookies['primary_db']      # expired
+        primary, replica = self.get(url)
+        self.assertEqual(primary, 0)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SearchVisibilityTests(TestCase):
+    def setUp(self):
+        self.course = create_course()
+        self.course.overview = 'Learn quantum things'
+        self.course.save()
+        module = Module.objects.create(course=self.course, title='Quantum module')
+        text = Text.objects.create(owner=self.course.owner, title='Notes', content='quantum secret answer')
+        Content.objects.create(module=module, item=text)
+
+    def search(self):
+        return self.client.get(reverse('api:search'), {'q': 'quantum'}).json()
+
+    def test_anonymous_users_only_get_course_hits(self):
+        data = self.search()
+        self.assertEqual([hit['kind'] for hit in data['results']], ['course'])
+        self.assertEqual(data['count'], 1)
+        self.assertNotIn('secret', json.dumps(data))
+
+        # neither do users not enrolled in the course
+        self.client.force_login(User.objects.create_user('other', password='password'))
+        self.assertEqual([hit['kind'] for hit in self.search()['results']], ['course'])
+
+    def test_enrolled_students_get_the_contents(self):
+        student = User.objects.create_user('student', password='password')
+        self.course.students.add(student)
+        self.client.force_login(student)
+        data = self.search()
+        self.assertEqual(sorted(hit['kind'] for hit in data['results']), ['course', 'module', 'text'])
+        self.assertIn('secret', json.dumps(data))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.backend = get_backend()
+
+    def test_backend(self):
+        self.backend.index('course', 1, 1, 'Django basics', 'web framework')
+        self.backend.index('module', 2, 1, 'Forms', 'django forms')
+        self.backend.index('course', 3, 3, 'Python', 'a language, and django')
+        self.assertEqual(self.backend.count('djan'), 3)     # prefix match
+        self.assertEqual(self.backend.hits('django')[0]['id'], 1)     # title match first
+        self.assertEqual(self.backend.course_ids('django'), [1, 3])
+        self.assertEqual(self.backend.course_ids('django', courses=[3]), [3])
+        self.assertEqual(self.backend.count('django', courses=[], public_kinds=('course',)), 2)
+        self.assertEqual(self.backend.count('django OR "x'), 0)     # no FTS syntax from users
+        self.backend.remove('course', 1)
+        self.assertEqual(self.backend.course_ids('basics'), [])
+
+    def test_documents_follow_the_objects(self):
+        course = create_course()
+        module = Module.objects.create(course=course, title='Quantum module')
+        text = Text.objects.create(owner=course.owner, title='Notes', content='entanglement')
+        self.assertEqual(self.backend.count('entanglement'), 0)     # not in a course yet
+        Content.objects.create(module=module, item=text)
+        self.assertEqual(self.backend.hits('entanglement')[0]['course'], course.id)
+        module.title = 'Relativity'
+        module.save()
+        self.assertEqual(self.backend.count('quantum'), 0)
+        self.assertEqual(self.backend.count('relativity'), 1)
+        module.delete()
+        self.assertEqual(self.backend.count('relativity entanglement'), 0)
+        self.assertEqual(self.backend.count('entanglement'), 0)
+
+    def test_search_within_a_subject(self):
+        course = create_course()
+        other = create_course(username='other', slug='other')
+        # the other subject has the better matches
+        other.title = 'Quantum quantum'
+        other.save()
+        course.overview = 'some quantum'
+        course.save()
+        with mock.patch.object(CourseListView, 'search_limit', 1):
+            response = self.client.get(
+                reverse('course_list_subject', args=[course.subject.slug]), {'q': 'quantum'}
+            )
+        self.assertEqual(response.context['courses'], [course])
+
+
+def use_temp_media(test):
+    # Uploaded files go to a temporary MEDIA_ROOT, deleted after the test.
+    media = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media)
+    media_settings = override_settings(
+        MEDIA_ROOT=media, UPLOAD_SESSIONS_DIR=os.path.join(media, 'uploads')
+    )
+    media_settings.enable()
+    test.addCleanup(media_settings.disable)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.course = create_course()
+        self.module = Module.objects.create(course=self.course, title='Module')
+
+    def create_file(self, data=b'slides'):
+        return File.objects.create(
+            owner=self.course.owner, title='Slides', file=ContentFile(data, name='slides.pdf')
+        )
+
+    def test_same_content_is_stored_once_and_freed_with_its_last_item(self):
+        first, second = self.create_file(), self.create_file()
+        other = self.create_file(b'other slides')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertTrue(first.file.name.startswith('blobs/'))
+        self.assertNotEqual(first.file.name, other.file.name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(first.file.storage.exists(second.file.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(first.file.storage.exists(second.file.name))
+
+    def test_blob_referenced_again_before_the_release_is_kept(self):
+        first = self.create_file()
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+            # same content uploaded again before the release callback runs
+            second = self.create_file()
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertTrue(second.file.storage.exists(second.file.name))
+        self.assertTrue(BlobLock.objects.filter(name=second.file.name).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(second.file.storage.exists(second.file.name))
+        self.assertFalse(BlobLock.objects.exists())
+
+    def test_resumable_upload(self):
+        self.client.force_login(self.course.owner)
+        response = self.client.post(
+            reverse('api:upload_create'), {'module': self.module.pk, 'filename': 'slides.pdf', 'size': 10}
+        )
+        self.assertEqual(response.status_code, 201)
+        session = UploadSession.objects.get(pk=response.data['id'])
+        url = reverse('api:upload', args=[session.pk])
+
+        def put(data, start):
+            return self.client.put(
+                url, data, content_type='application/octet-stream',
+                headers={'content-range': f'bytes {start}-{start + len(data) - 1}/10'}
+            )
+
+        self.assertEqual(put(b'0123', 0).data['offset'], 4)
+        response = put(b'0123', 0)     # sent again
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 4)
+        self.assertTrue(put(b'456789', 4).data['complete'])
+
+        response = self.client.post(
+            reverse('api:upload_complete', args=[session.pk]), {'type': 'file', 'title': 'Slides'}
+        )
+        self.assertEqual(response.status_code, 201)
+        item = File.objects.get(pk=response.data['item'])
+        self.assertEqual(item.file.read(), b'0123456789')
+        self.assertEqual(self.module.contents.get().item, item)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(session.part_path))
+
+    @override_settings(UPLOAD_MAX_OPEN_SESSIONS=2, UPLOAD_MAX_OPEN_SIZE=100)
+    def test_upload_sessions_are_limited(self):
+        url = reverse('api:upload_create')
+
+        def create(size=10):
+            return self.client.post(url, {'module': self.module.pk, 'filename': 'a.pdf', 'size': size})
+
+        # a student (or any other user) can't upload to the module
+        self.client.force_login(User.objects.create_user('student', password='password'))
+        self.assertEqual(create().status_code, 403)
+        self.assertFalse(UploadSession.objects.exists())
+
+        self.client.force_login(self.course.owner)
+        self.assertEqual(create(size=60).status_code, 201)
+        self.assertEqual(create(size=50).status_code, 413)     # 110 bytes in total
+        self.assertEqual(create().status_code, 201)
+        self.assertEqual(create().status_code, 429)     # too many unfinished uploads
+
+
+@override_settings(CACHES=TEST_CACHES, UPLOAD_MAX_OPEN_SESSIONS=3)
+class UploadSessionConcurrencyTests(TransactionTestCase):
+    clients = 8
+
+    def test_concurrent_uploads_respect_the_caps(self):
+        use_temp_media(self)
+        course = create_course()
+        module = Module.objects.create(course=course, title='Module')
+        barrier = threading.Barrier(self.clients)
+        statuses = []
+        errors = []
+
+        def create(client):
+            try:
+                barrier.wait()      # all the requests at the same time
+                response = client.post(
+                    reverse('api:upload_create'), {'module': module.pk, 'filename': 'a.pdf', 'size': 10}
+                )
+                statuses.append(response.status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        clients = [Client() for n in range(self.clients)]
+        for client in clients:
+            client.force_login(course.owner)
+        threads = [threading.Thread(target=create, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(statuses), [201] * 3 + [429] * (self.clients - 3))
+        self.assertEqual(UploadSession.objects.filter(owner=course.owner).count(), 3)
+
+
+@override_settings(CACHES=TEST_CACHES, IMAGE_DERIVATIVE_WORKERS=0, IMAGE_DERIVATIVE_WIDTHS=(320, 640))
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.owner = User.objects.create_user('instructor', password='password')
+
+    def jpeg(self, size=(1000, 500)):
+        data = BytesIO()
+        PILImage.new('RGB', size, 'teal').save(data, 'JPEG')
+        return ContentFile(data.getvalue(), name='diagram.jpg')
+
+    def create_image(self):
+        return Image.objects.create(owner=self.owner, title='Diagram', file=self.jpeg())
+
+    def test_original_until_the_variants_are_ready(self):
+        image = self.create_image()
+        self.assertNotIn('srcset', image.render())
+
+        generate_derivatives(image.pk)
+        image.refresh_from_db()
+        self.assertEqual(
+            [(v['width'], v['type']) for v in image.derivatives['variants']],
+            [(320, 'image/webp'), (320, 'image/jpeg'), (640, 'image/webp'),
+             (640, 'image/jpeg'), (1000, 'image/webp')]
+        )
+        for variant in image.derivatives['variants']:
+            with PILImage.open(image.file.storage.open(variant['name'])) as picture:
+                self.assertEqual(picture.width, variant['width'])
+        html = image.render()
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(f'{image.file.url} 1000w', html)
+
+    def test_new_file_resets_the_variants(self):
+        image = self.create_image()
+        generate_derivatives(image.pk)
+        image.refresh_from_db()
+        image.file = self.jpeg(size=(200, 100))
+        image.save()
+        self.assertEqual(image.derivatives, {})
+
+
+
+@override_settings(CACHES=TEST_CACHES)
+class VideoEmbedTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('instructor', password='password')
+
+    def test_embed_data_is_resolved_on_save(self):
+        video = Video.objects.create(
+            owner=self.owner, title='Video', url='https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+        )
+        self.assertEqual(video.backend, 'YoutubeBackend')
+        self.assertTrue(video.embed_url.startswith('https://www.youtube.com/embed/dQw4w9WgXcQ'))
+        self.assertEqual(video.thumbnail_url, 'https://img.youtube.com/vi/dQw4w9WgXcQ/hqdefault.jpg')
+        self.assertIn(f'src="{video.embed_url}"', video.render())
+
+    def test_unknown_provider_is_rendered_as_a_link(self):
+        video = Video.objects.create(owner=self.owner, title='Video', url='https://example.com/v')
+        self.assertEqual(video.embed_url, '')
+        self.assertIn('href="https://example.com/v"', video.render())
+
+    def test_embed_data_is_only_resolved_again_when_the_url_changes(self):
+        video = Video.objects.create(
+            owner=self.owner, title='Video', url='https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+        )
+        with mock.patch.object(Video, 'refresh_embed', autospec=True) as refresh_embed:
+            video.title = 'Renamed'
+            video.save()
+            refresh_embed.assert_not_called()
+
+            video.url = 'https://www.youtube.com/watch?v=9bZkp7q19f0'
+            video.save()
+            refresh_embed.assert_called_once_with(video)
+
+            # not resolved yet (e.g. the provider was unreachable): try again
+            refresh_embed.reset_mock()
+            Video.objects.filter(pk=video.pk).update(embed_url='')
+            video = Video.objects.get(pk=video.pk)
+            video.save()
+            refresh_embed.assert_called_once_with(video)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CacheWarmerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.course = create_course()
+        self.module = Module.objects.create(course=self.course, title='Module')
+        text = Text.objects.create(owner=self.course.owner, title='Intro', content='Hello')
+        Content.objects.create(module=self.module, item=text)
+
+    def test_warm_builds_the_entries_once(self):
+        report = warm(workers=1)
+        self.assertEqual(report['failed'], 0)
+        self.assertEqual(report['built'], report['entries'])
+        self.assertIsNotNone(cache.get('all_courses', version=get_version('catalog:courses')))
+        key = module_contents_key(self.module.id, get_version(module_contents_family(self.module.id)))
+        self.assertIn('Hello', cache.get(key))
+
+        # the student page uses the warmed fragment
+        self.client.force_login(self.course.owner)
+        self.course.students.add(self.course.owner)
+        cache.set(key, 'warmed fragment')
+        response = self.client.get(reverse('student_course_detail_module', args=[self.course.id, self.module.id]))
+        self.assertContains(response, 'warmed fragment')
+
+        report = warm(workers=2)
+        self.assertEqual(report['cached'], report['entries'])
+
+
+class FakeRedis:
+    # In-memory Redis server for the TwoTierRedisCache tests: the parts of the redis-py client
+    # used by Django's RedisCache, and pub/sub. Shared by the clients of several "processes".
+    def __init__(self):
+        self.data = {}
+        self.subscribers = {}       # channel -> [FakePubSub]
+
+    def client(self, connection_pool=None):
+        return self
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def exists(self, key):
+        return key in self.data
+
+    def incr(self, key, delta):
+        self.data[key] += delta
+        return self.data[key]
+
+    def publish(self, channel, message):
+        for pubsub in self.subscribers.get(channel, []):
+            pubsub.messages.put({'type': 'message', 'data': message.encode()})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self)
+
+
+class FakePubSub:
+    STOP = object()
+
+    def __init__(self, server):
+        self.server = server
+        self.messages = queue.Queue()
+
+    def subscribe(self, channel):
+        self.server.subscribers.setdefault(channel, []).append(self)
+
+    def listen(self):
+        while True:
+            message = self.messages.get()
+            if message is self.STOP:
+                raise SystemExit        # ends the listener thread (not caught as a disconnection)
+            yield message
+            self.messages.task_done()   # the listener handled it
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TwoTierCacheTests(TestCase):
+    def test_local_tier_is_a_bounded_lru_with_ttl(self):
+        local = LocalTier(max_entries=2, timeout=60)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)       # evicts 'b', the least recently used
+        self.assertEqual([local.get(key) for key in 'ac'], [1, 3])
+        self.assertIs(local.get('b'), MISSING)
+        local.set('d', 4, timeout=0)    # not kept
+        self.assertEqual(local.snapshot(), {
+            'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'entries': 2, 'evictions': 1,
+        })
+
+    def test_invalidation_messages(self):
+        backend = TwoTierRedisCache(
+            'redis://localhost:6379/15',
+            {'KEY_PREFIX': 'two-tier-test', 'OPTIONS': {'LOCAL_PREFIXES': ['all_']}},
+        )
+        self.assertTrue(backend.is_local('all_courses'))
+        self.assertFalse(backend.is_local('version:catalog:courses'))
+        local = backend.shared.local
+        key = backend.make_key('all_courses', version=3)
+        local.set(key, ['course'])
+        backend.handle_message(f'{backend.shared.origin}:{key}'.encode())     # sent by this process: ignored
+        self.assertEqual(local.get(key), ['course'])
+        backend.handle_message(f'other:{key}'.encode())
+        self.assertEqual(len(local.entries), 0)
+
+    def process(self, server):
+        # A TwoTierRedisCache with the state of a separate process (local tier, origin),
+        # talking to the shared fake server.
+        with mock.patch.dict(two_tier._shared, clear=True):
+            backend = TwoTierRedisCache(
+                'redis://localhost:6379/15',
+                {'KEY_PREFIX': 'two-tier-test', 'OPTIONS': {'LOCAL_PREFIXES': ['all_']}},
+            )
+        backend._cache._client = server.client
+        self.addCleanup(self.stop_listener, backend, server)
+        return backend
+
+    def stop_listener(self, backend, server):
+        for pubsub in server.subscribers.get(backend.channel, []):
+            pubsub.messages.put(FakePubSub.STOP)
+        if backend.shared.listener:
+            backend.shared.listener.join(timeout=5)
+
+    def wait_for_subscribers(self, server, channel, count):
+        for _ in range(500):
+            if len(server.subscribers.get(channel, [])) == count:
+                return
+            time.sleep(0.01)
+        self.fail('the listeners did not subscribe')
+
+    def deliver(self, server, channel):
+        # wait until every listener handled the published messages
+        for pubsub in server.subscribers[channel]:
+            pubsub.messages.join()
+
+    def test_writes_evict_the_local_entries_of_other_processes(self):
+        server = FakeRedis()
+        first, second = self.process(server), self.process(server)
+        key = first.make_key('all_courses')
+        first.set('all_courses', ['old'])
+        self.assertEqual(second.get('all_courses'), ['old'])   # from Redis, then kept locally
+        self.wait_for_subscribers(server, first.channel, 2)
+        self.assertEqual(second.shared.local.get(key), ['old'])
+
+        first.set('all_courses', ['new'])
+        self.deliver(server, first.channel)
+        self.assertNotIn(key, second.shared.local.entries)
+        # the writer ignored its own message: its local copy is the new value
+        self.assertEqual(first.shared.local.get(key), ['new'])
+        self.assertEqual(second.get('all_courses'), ['new'])
+
+        second.delete('all_courses')
+        self.deliver(server, first.channel)
+        self.assertNotIn(key, first.shared.local.entries)
+        self.assertIsNone(first.get('all_courses'))
+
+    def test_keys_without_a_local_prefix_are_not_kept_locally(self):
+        server = FakeRedis()
+        backend = self.process(server)
+        backend.set('version:catalog:courses', 7)
+        backend.incr('version:catalog:courses')
+        self.assertEqual(backend.get('version:catalog:courses'), 8)
+        self.assertEqual(backend.shared.local.entries, {})
+        self.assertEqual(backend.stats()['remote']['hits'], 1)
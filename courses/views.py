@@ -4,16 +4,25 @@ from django.shortcuts import render
 from django.views.generic.list import ListView
 from .models import Course, Module, Content, Subject
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
-from django.shortcuts import get_object_or_404, redirect
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect
 from django.views.generic.base import TemplateResponseMixin, View
 from django.views.generic.detail import DetailView
 from .forms import ModuleFormSet
 from django.apps import apps
 from django.forms.models import modelform_factory
 from braces.views import CsrfExemptMixin, JsonRequestResponseMixin
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Case, PositiveIntegerField, Value, When
 from students.forms import CourseEnrollForm
+from asgiref.sync import sync_to_async
 from django.core.cache import cache
+from django.conf import settings
+from .caching import (
+    aget_versions, bump_version, course_structure_family, module_contents_family,
+    subject_courses_family
+)
+from .catalog import courses_queryset, subjects_queryset
+from .search import get_backend
 
 
 
@@ -195,50 +204,154 @@ class ModuleContentListView(TemplateResponseMixin, View):
 
     def get(self, request, module_id):
         module = get_object_or_404(
-            Module, id=module_id, course__owner=request.user
+            Module.objects.select_related('course'), id=module_id, course__owner=request.user
+        )
+        return self.render_to_response(
+            {
+                'module': module,
+                'contents': module.contents.with_items()    # items resolved in bulk, not per row
+            }
         )
-        return self.render_to_response({'module': module})
 
 
 # Re-ordering modules and their contents
 # JsonRequestResponseMixin: A mixin that attempts to parse the request as JSON. If the request is properly formatted,
 # the JSON is saved to self.request_json as a Python object. request_json will be 'None' for unparseable requests.
-class ModuleOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
+class OrderUpdateMixin(CsrfExemptMixin, JsonRequestResponseMixin):
+    # The payload is the complete new order of ONE parent, e.g. {"<module id>": <order>, ...} for
+    # all the modules of a course. Instead of one UPDATE (with its own ownership join) per id:
+    # - ownership, parent and completeness are checked with one query,
+    # - only the rows whose order really changes are updated, with a single
+    #   UPDATE ... SET order = CASE id WHEN ... END per batch, inside one transaction.
+    model = None
+    parent_field = None     # 'course' for modules, 'module' for contents
+    owner_lookup = None     # lookup from the model to the owner of the course
+    batch_size = 500        # keeps the CASE and the IN (...) list under the database parameter limits
+
+    def get_orders(self):
+        if not isinstance(self.request_json, dict) or not self.request_json:
+            return None
+        try:
+            orders = {int(id): int(order) for id, order in self.request_json.items()}
+        except (TypeError, ValueError):
+            return None
+        if any(order < 0 for order in orders.values()):
+            return None
+        return orders
+
     def post(self, request):
-        for id, order in self.request_json.items():
-            Module.objects.filter(
-                id=id, course__owner=request.user
-            ).update(order=order)
-        return self.render_json_response({'saved':'OK'})
+        orders = self.get_orders()
+        if orders is None:
+            return self.render_bad_request_response(
+                {'errors': ['Expected a JSON object mapping ids to orders (integers >= 0).']}
+            )
+
+        parent_id = f'{self.parent_field}_id'
+        # All the (owned) siblings of the submitted objects, in one query.
+        siblings = {
+            id: (parent, order) for id, parent, order in self.model.objects.filter(
+                **{
+                    f'{parent_id}__in': self.model.objects.filter(id__in=orders).values(parent_id),
+                    self.owner_lookup: request.user,
+                }
+            ).values_list('id', parent_id, 'order')
+        }
+        unknown = orders.keys() - siblings.keys()
+        if unknown:
+            return self.render_bad_request_response(
+                {'errors': ['Unknown ids.'], 'ids': sorted(unknown)}
+            )
+        if len({parent for parent, order in siblings.values()}) > 1:
+            return self.render_bad_request_response(
+                {'errors': [f'All ids must belong to the same {self.parent_field}.']}
+            )
+        missing = siblings.keys() - orders.keys()
+        if missing:
+            return self.render_bad_request_response(
+                {'errors': ['Partial order: some ids are missing.'], 'ids': sorted(missing)}
+            )
+
+        changed = [(id, order) for id, order in orders.items() if siblings[id][1] != order]
+        updated = 0
+        parent, order = next(iter(siblings.values()))
+        with transaction.atomic():
+            if changed:
+                # The next allocated order (OrderField counter) must come after the new ones.
+                order_field = self.model._meta.get_field('order')
+                order_field.advance(
+                    order_field.get_scope(self.model(**{parent_id: parent})), max(orders.values())
+                )
+            for start in range(0, len(changed), self.batch_size):
+                batch = changed[start:start + self.batch_size]
+                updated += self.model.objects.filter(
+                    id__in=[id for id, order in batch]
+                ).update(
+                    order=Case(
+                        *[When(id=id, then=Value(order)) for id, order in batch],
+                        output_field=PositiveIntegerField()
+                    )
+                )
+        if updated:
+            # update() sends no signals: invalidate what shows the order here.
+            self.orders_changed(parent)
+        return self.render_json_response({'saved': 'OK', 'updated': updated})
+
+    def orders_changed(self, parent_id):
+        pass
+
+
+class ModuleOrderView(OrderUpdateMixin, View):
+    model = Module
+    parent_field = 'course'
+    owner_lookup = 'course__owner'
+
+    def orders_changed(self, course_id):
+        bump_version(course_structure_family(course_id))
+        Course.objects.filter(pk=course_id).touch()
 # Key Takeaway:
 # The reorder view only updates numbers.
 # The display views sort by those numbers, usually via Meta.ordering of the 'Module' model class.
 
 
-class ContentOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
-    def post(self, request):
-        for id, order in self.request_json.items():
-            Content.objects.filter(
-                id=id, module__course__owner=request.user
-            ).update(order=order)
-        return self.render_json_response({'saved':'OK'})
-    
+class ContentOrderView(OrderUpdateMixin, View):
+    model = Content
+    parent_field = 'module'
+    owner_lookup = 'module__course__owner'
 
+    def orders_changed(self, module_id):
+        bump_version(module_contents_family(module_id))
+
+
+# Async catalog views
+# 'async def get': under ASGI (educa/asgi.py, served by uvicorn) the view runs on the event
+# loop, so while one request waits for Redis or the database, the worker serves others.
+# The ORM and cache calls use their async variants (aget(), async for, cache.aget(), ...)
+# and everything the template needs is loaded before rendering: lazy querysets can't be
+# evaluated from async code. Under WSGI (runserver, the test client) Django runs them with
+# async_to_sync(), they work the same way.
 class CourseListView(TemplateResponseMixin, View):
     model = Course
     template_name = 'courses/course/list.html'
-    def get(self, request, subject=None):
+    search_limit = 50   # max courses shown for a search
+    async def get(self, request, subject=None):
         # # ALWAYS get all subjects with counts (for sidebar)
         # subjects = Subject.objects.annotate(
         #     total_courses=Count('courses')
         # )
         # These above line is replaced by the caching 'all_subjects'.
-        subjects = cache.get('all_subjects')
+        # Catalog entries are read and written with the current version of their key family;
+        # writes to courses/subjects/modules bump the version (see courses/signals.py).
+        families = ['catalog:subjects', 'catalog:courses']
+        if subject:
+            subject = await aget_object_or_404(Subject, slug=subject)
+            families.append(subject_courses_family(subject.id))
+        versions = await aget_versions(*families)
+        timeout = settings.CATALOG_CACHE_TIMEOUT
+
+        subjects = await cache.aget('all_subjects', version=versions['catalog:subjects'])
         if subjects is None:
-            subjects = Subject.objects.annotate(
-                total_courses=Count('courses')
-            )
-            cache.set('all_subjects', subjects)
+            subjects = [s async for s in subjects_queryset()]
+            await cache.aset('all_subjects', subjects, timeout, version=versions['catalog:subjects'])
             # Here, the cache.set() enforces the evaluation of the queryset before
             # storing into the cache.
             # WHY?
@@ -254,30 +367,47 @@ class CourseListView(TemplateResponseMixin, View):
         # - Django finishes talking to the database, collects the data and only then gives
         # Memcached something simple enough to store.
 
-        # ALWAYS start with all courses
-        all_courses = Course.objects.annotate(
-            total_modules=Count('modules')
-        )
+        # ALWAYS start with all courses (with their subject and instructor, see courses/catalog.py)
+        # 'manage.py warm_cache' builds these entries ahead of the first visitors.
+        all_courses = courses_queryset()
+        query = request.GET.get('q', '').strip()
+        if query:
+            # Search box: the best matching courses, ranked by the full-text index (not cached).
+            # Within a subject, the index only ranks the courses of the subject (filtering the
+            # global top results afterwards would drop matches of this subject).
+            subject_courses = None
+            if subject:
+                subject_courses = [
+                    pk async for pk in Course.objects.filter(subject=subject).values_list('pk', flat=True)
+                ]
+            course_ids = await sync_to_async(get_backend().course_ids)(
+                query, limit=self.search_limit, courses=subject_courses
+            )
+            matches = all_courses.filter(pk__in=course_ids)
+            courses = sorted(
+                [c async for c in matches], key=lambda course: course_ids.index(course.pk)
+            )
         # IF subject provided, filter down
-        if subject:
-            subject = get_object_or_404(Subject, slug=subject)
+        elif subject:
             key = f'subject_{subject.id}_courses'
-            courses = cache.get(key)
+            version = versions[subject_courses_family(subject.id)]
+            courses = await cache.aget(key, version=version)
             if courses is None:
-                courses = all_courses.filter(subject=subject)
-                cache.set(key, courses)
+                courses = [c async for c in all_courses.filter(subject=subject)]
+                await cache.aset(key, courses, timeout, version=version)
         # ELSE courses stays as "all courses"
         else:
-            courses = cache.get('all_courses')
+            courses = await cache.aget('all_courses', version=versions['catalog:courses'])
             if courses is None:
-                courses = all_courses
-                cache.set('all_courses', courses)
+                courses = [c async for c in all_courses]
+                await cache.aset('all_courses', courses, timeout, version=versions['catalog:courses'])
 
         return self.render_to_response(
             {
             'subjects': subjects,   # Always show all subjects (for navigation)
             'subject': subject,     # Currently selected subject (or None)
-            'courses': courses      # All courses OR filtered courses
+            'courses': courses,     # All courses OR filtered courses
+            'query': query,         # Search terms (or '')
             }
         )
 
@@ -286,6 +416,16 @@ class CourseDetailView(DetailView):
     model = Course
     template_name = 'courses/course/detail.html'
 
+    def get_queryset(self):
+        # The template shows the subject and the instructor.
+        return Course.objects.select_related('subject', 'owner')
+
+    async def get(self, request, *args, **kwargs):
+        # DetailView.get() with the async ORM (get_object() is synchronous).
+        self.object = await aget_object_or_404(self.get_queryset(), slug=kwargs['slug'])
+        context = self.get_context_data(object=self.object)
+        return self.render_to_response(context)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Add the enrollment form to context
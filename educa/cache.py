@@ -0,0 +1,268 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.redis import RedisCache
+
+
+logger = logging.getLogger(__name__)
+
+
+# Two-tier cache
+# Every catalog request reads 'all_subjects' and a course list from Redis and unpickles them,
+# although they rarely change. TwoTierRedisCache is the Django RedisCache with a small LRU
+# dictionary in each process in front of it, for the keys starting with one of the
+# OPTIONS['LOCAL_PREFIXES']: a hit costs neither a round trip nor unpickling.
+#
+# Invalidation across processes:
+# - the catalog keys are versioned (courses/caching.py): the version keys are not kept
+#   locally, so a new version is seen by every process on its next request;
+# - set()/delete()/incr()/clear() of a local key are published on a Redis channel, and every
+#   process drops its copy (a thread per process listens to it);
+# - each local entry expires after OPTIONS['LOCAL_TIMEOUT'] seconds anyway, which bounds the
+#   staleness if a message is lost (the local tier is also emptied when the listener reconnects).
+#
+# The local values are shared by the threads of the process, not copied: only use it for keys
+# whose values are not modified once read (catalog lists, rendered template fragments).
+#
+# hit/miss counters of both tiers: stats(), shown by /metrics/ (educa/metrics.py).
+
+MISSING = object()
+
+
+class TierStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def snapshot(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else None,
+        }
+
+
+class LocalTier:
+    # Bounded LRU with a time to live per entry, shared by the threads of the process.
+    def __init__(self, max_entries=500, timeout=60):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> (expiry time, value), least recently used first
+        self.stats = TierStats()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self.entries[key]
+                entry = None
+            self.stats.record(entry is not None)
+            if entry is None:
+                return MISSING
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        if timeout <= 0:
+            self.delete(key)
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def snapshot(self):
+        return self.stats.snapshot() | {'entries': len(self.entries), 'evictions': self.evictions}
+
+
+class SharedState:
+    # Django creates a cache backend instance per thread: what the process shares lives here.
+    def __init__(self, max_entries, timeout):
+        self.local = LocalTier(max_entries, timeout)
+        self.remote = TierStats()
+        self.lock = threading.Lock()
+        self.listener = None
+        self.origin = uuid.uuid4().hex      # this process, to ignore its own invalidation messages
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class TwoTierRedisCache(RedisCache):
+    def __init__(self, server, params):
+        options = dict(params.get('OPTIONS', {}))
+        self.local_prefixes = tuple(options.pop('LOCAL_PREFIXES', ()))
+        max_entries = options.pop('LOCAL_MAX_ENTRIES', 500)
+        local_timeout = options.pop('LOCAL_TIMEOUT', 60)
+        super().__init__(server, {**params, 'OPTIONS': options})    # the rest is for redis-py
+        self.channel = f'{self.key_prefix}:cache-invalidation'
+        with _shared_lock:
+            self.shared = _shared.setdefault(
+                (tuple(self._servers), self.key_prefix), SharedState(max_entries, local_timeout)
+            )
+
+    def is_local(self, key):
+        return bool(self.local_prefixes) and key.startswith(self.local_prefixes)
+
+    def stats(self):
+        return {'local': self.shared.local.snapshot(), 'remote': self.shared.remote.snapshot()}
+
+    # Local tier and invalidation messages
+
+    def keep_local(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self.start_listener()
+        timeout = self.get_backend_timeout(timeout)
+        self.shared.local.set(key, value, timeout)
+
+    def invalidate(self, *keys):
+        # keys: full (Redis) keys, or '*' for everything
+        if '*' in keys:
+            self.shared.local.clear()
+        else:
+            self.shared.local.delete(*keys)
+        client = self._cache.get_client(write=True)
+        for key in keys:
+            client.publish(self.channel, f'{self.shared.origin}:{key}')
+
+    def handle_message(self, data):
+        origin, _, key = data.decode().partition(':')
+        if origin == self.shared.origin:
+            return      # already applied by this process
+        if key == '*':
+            self.shared.local.clear()
+        else:
+            self.shared.local.delete(key)
+
+    def start_listener(self):
+        shared = self.shared
+        if shared.listener is None:
+            with shared.lock:
+                if shared.listener is None:
+                    shared.listener = threading.Thread(
+                        target=self.listen, name='cache-invalidation', daemon=True
+                    )
+                    shared.listener.start()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self._cache.get_client(write=True).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self.handle_message(message['data'])
+            except Exception:
+                logger.warning('Cache invalidation listener disconnected', exc_info=True)
+            # Messages may have been missed meanwhile.
+            self.shared.local.clear()
+            time.sleep(1)
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        local = self.is_local(key)
+        key = self.make_and_validate_key(key, version=version)
+        if local:
+            value = self.shared.local.get(key)
+            if value is not MISSING:
+                return value
+        value = self._cache.get(key, MISSING)
+        self.shared.remote.record(value is not MISSING)
+        if value is MISSING:
+            return default
+        if local:
+            self.keep_local(key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote_keys = {}
+        for key in keys:
+            full_key = self.make_and_validate_key(key, version=version)
+            value = self.shared.local.get(full_key) if self.is_local(key) else MISSING
+            if value is MISSING:
+                remote_keys[full_key] = key
+            else:
+                found[key] = value
+        if remote_keys:
+            values = self._cache.get_many(remote_keys.keys())
+            for full_key, key in remote_keys.items():
+                self.shared.remote.record(full_key in values)
+                if full_key in values:
+                    found[key] = values[full_key]
+                    if self.is_local(key):
+                        self.keep_local(full_key, values[full_key])
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout, version=version)
+        if self.is_local(key):
+            full_key = self.make_and_validate_key(key, version=version)
+            self.invalidate(full_key)
+            self.keep_local(full_key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = super().add(key, value, timeout, version=version)
+        if added and self.is_local(key):
+            self.invalidate(self.make_and_validate_key(key, version=version))
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = super().set_many(data, timeout, version=version)
+        local = {
+            self.make_and_validate_key(key, version=version): value
+            for key, value in data.items() if self.is_local(key)
+        }
+        if local:
+            self.invalidate(*local)
+            for full_key, value in local.items():
+                self.keep_local(full_key, value, timeout)
+        return failed
+
+    def delete(self, key, version=None):
+        deleted = super().delete(key, version=version)
+        if self.is_local(key):
+            self.invalidate(self.make_and_validate_key(key, version=version))
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        super().delete_many(keys, version=version)
+        local = [self.make_and_validate_key(key, version=version) for key in keys if self.is_local(key)]
+        if local:
+            self.invalidate(*local)
+
+    def incr(self, key, delta=1, version=None):
+        value = super().incr(key, delta, version=version)
+        if self.is_local(key):
+            self.invalidate(self.make_and_validate_key(key, version=version))
+        return value
+
+    def clear(self):
+        cleared = super().clear()
+        if self.local_prefixes:
+            self.invalidate('*')
+        return cleared
@@ -0,0 +1,101 @@
+import random
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+# Read replicas
+# The catalog, student and API pages mostly read. ReplicaRouter sends the reads of a request to
+# one of the replica aliases (settings.DATABASE_REPLICAS) and all the writes to 'default', the
+# primary. A replica lags behind the primary, so a user who just wrote (enrolled, edited or
+# reordered content) must not read from it for a while, or they wouldn't see their own change:
+# - within a request: after the first write, the reads of the request go to the primary;
+# - after the request: ReplicaPinningMiddleware sets a cookie, and the requests carrying it
+#   (settings.REPLICA_PIN_SECONDS) read from the primary too.
+# Outside of requests (management commands, worker threads) everything uses the primary.
+#
+# Anything cached for hours must be built from the primary (see PRIMARY in courses/catalog.py):
+# a replica that hasn't seen a change yet would store the old data under the new cache version.
+
+PRIMARY = 'default'
+PIN_COOKIE = 'primary_db'
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        self.pinned = pinned    # reads go to the primary
+        self.wrote = False
+
+
+# State of the current request, set by ReplicaPinningMiddleware. A context variable, so the
+# requests served concurrently by an ASGI worker (and the threads of their sync_to_async()
+# calls, which run in a copy of the context) each see their own.
+routing_state = ContextVar('routing_state', default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if state is None or state.pinned or not settings.DATABASE_REPLICAS:
+            return PRIMARY
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True     # the replicas hold the same data
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema from the primary (replication, or a copy of the file locally).
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReplicaPinningMiddleware:
+    # Sync and async, like educa.metrics.RequestMetricsMiddleware.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def start(request):
+        # Unsafe methods write: no point reading from a replica first.
+        pinned = PIN_COOKIE in request.COOKIES or request.method not in ('GET', 'HEAD', 'OPTIONS')
+        state = RoutingState(pinned=pinned)
+        return state, routing_state.set(state)
+
+    @staticmethod
+    def finish(state, token, response):
+        routing_state.reset(token)
+        if state.wrote:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            routing_state.reset(token)
+            raise
+        return self.finish(state, token, response)
+
+    async def __acall__(self, request):
+        state, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            routing_state.reset(token)
+            raise
+        return self.finish(state, token, response)
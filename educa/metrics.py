@@ -0,0 +1,219 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
+from django.db import connections
+from django.http import JsonResponse
+
+
+# Per-view request metrics
+# RequestMetricsMiddleware records, for every resolved URL name ('course_list',
+# 'api:course-list', ...), the latency, the number of SQL queries, the SQL time and the body
+# size of each request into in-process histograms. A histogram is a fixed list of bucket counters, so
+# recording a request is a few integer increments: nothing is stored per request and memory
+# doesn't grow with traffic (unlike the debug toolbar, which keeps every query).
+# The numbers are per process; /metrics/ (staff only) returns those of the process serving it.
+#
+# Streaming responses (e.g. the JSON Lines exports) produce their body, and run most of their
+# queries, while it is sent, after the view returned: they are recorded when the stream ends,
+# so their latency, queries and size cover the whole body. A stream that is never started
+# (the client went away first) is not recorded.
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SQL_TIME_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+BODY_BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)     # the last bucket counts values above all bounds
+        self.total = 0
+        self.sum = 0.0
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket the q-th value falls in (inf for the overflow bucket).
+        if not self.total:
+            return None
+        rank = math.ceil(q * self.total)
+        seen = 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def snapshot(self):
+        return {
+            'buckets': {
+                f'le_{bound}': count for bound, count in zip(self.bounds, self.counts)
+            } | {'overflow': self.counts[-1]},
+            'sum': round(self.sum, 3),
+            'mean': round(self.sum / self.total, 3) if self.total else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql_ms = Histogram(SQL_TIME_BUCKETS_MS)
+        self.body_bytes = Histogram(BODY_BYTES_BUCKETS)
+
+    def record(self, latency_ms, queries, sql_ms, body_bytes):
+        with self.lock:
+            self.requests += 1
+            self.latency_ms.record(latency_ms)
+            self.queries.record(queries)
+            self.sql_ms.record(sql_ms)
+            self.body_bytes.record(body_bytes)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'latency_ms': self.latency_ms.snapshot(),
+                'queries': self.queries.snapshot(),
+                'sql_ms': self.sql_ms.snapshot(),
+                'body_bytes': self.body_bytes.snapshot(),
+            }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def get(self, name):
+        metrics = self.views.get(name)
+        if metrics is None:
+            # Only the first request of each URL name allocates its histograms.
+            with self.lock:
+                metrics = self.views.setdefault(name, ViewMetrics())
+        return metrics
+
+    def snapshot(self):
+        return {name: self.views[name].snapshot() for name in sorted(self.views)}
+
+
+registry = MetricsRegistry()
+
+
+class QueryCounter:
+    # Database execute wrapper: counts the queries of the request and their time.
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.queries += 1
+
+
+class RequestMetricsMiddleware:
+    # Sync and async: under ASGI, a sync-only middleware would make Django run the whole
+    # (async) middleware chain and view through a thread.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def watch_queries(stack, counter):
+        # Database connections are per thread: this must run in the thread running the queries.
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+
+    def record(self, request, start, counter, body_bytes):
+        latency = time.perf_counter() - start
+        match = request.resolver_match
+        name = match.view_name if match else '<unresolved>'
+        registry.get(name).record(latency * 1000, counter.queries, counter.time * 1000, body_bytes)
+
+    def finish(self, request, start, counter, response):
+        if not response.streaming:
+            self.record(request, start, counter, len(response.content))
+        elif response.is_async:
+            response.streaming_content = self.astream(request, start, counter, response.streaming_content)
+        else:
+            response.streaming_content = self.stream(request, start, counter, response.streaming_content)
+        return response
+
+    def stream(self, request, start, counter, content):
+        # Runs in the thread sending the body (the queries of the stream run there).
+        body_bytes = 0
+        try:
+            with ExitStack() as stack:
+                self.watch_queries(stack, counter)
+                for chunk in content:
+                    body_bytes += len(chunk)
+                    yield chunk
+        finally:
+            self.record(request, start, counter, body_bytes)
+
+    async def astream(self, request, start, counter, content):
+        body_bytes = 0
+        stack = ExitStack()
+        await sync_to_async(self.watch_queries)(stack, counter)
+        try:
+            async for chunk in content:
+                body_bytes += len(chunk)
+                yield chunk
+        finally:
+            await sync_to_async(stack.close)()
+            self.record(request, start, counter, body_bytes)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            self.watch_queries(stack, counter)
+            response = self.get_response(request)
+        return self.finish(request, start, counter, response)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        # The async ORM runs the queries of a request in one worker thread (sync_to_async with
+        # thread_sensitive=True): watch the connections of that thread.
+        stack = ExitStack()
+        await sync_to_async(self.watch_queries)(stack, counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, start, counter, response)
+
+
+@staff_member_required
+def metrics_view(request):
+    snapshot = registry.snapshot()
+    # hit/miss counters of the cache tiers (educa/cache.py), under a name no view can have
+    for alias in caches:
+        if hasattr(caches[alias], 'stats'):
+            snapshot[f'cache:{alias}'] = caches[alias].stats()
+    return JsonResponse(snapshot)
@@ -47,8 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'educa.metrics.RequestMetricsMiddleware',   # per-view latency/SQL histograms, see /metrics/
     'django.middleware.security.SecurityMiddleware',
+    'educa.db.ReplicaPinningMiddleware',    # read replicas, read-your-writes (educa/db.py)
     'django.contrib.sessions.middleware.SessionMiddleware',
     # 'django.middleware.cache.UpdateCacheMiddleware',  # Used for per-site cache only
     'django.middleware.common.CommonMiddleware',
@@ -59,6 +60,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if DEBUG:
+    # The debug toolbar records every query of every request: development only.
+    MIDDLEWARE.insert(1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 # Cache Middleware settings
 CACHE_MIDDLEWARE_ALIAS = 'default'  # Using 'default' cache for your cache middleware
 CACHE_MIDDLEWARE_SECONDS = 60 * 15  # Set global timeout to 15 minutes
@@ -100,9 +105,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        # SQLite ignores select_for_update(): start every transaction with the write lock
+        # instead, so transactions that read then write (e.g. the upload caps of
+        # UploadSessionCreateView) run one after the other rather than failing with
+        # 'database is locked' when both try to write.
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        # Tests use a file instead of the default in-memory database: the threads of
+        # OrderFieldConcurrencyTests share an in-memory database through SQLite's shared cache,
+        # whose table locks fail at once ('database table is locked') instead of waiting like
+        # the file locks do. Removed again when the test run ends.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    },
+    # Read replica (educa/db.py), only used once listed in DATABASE_REPLICAS. Locally, a copy
+    # of the primary stands in for it ('cp db.sqlite3 db_replica.sqlite3', to repeat after
+    # migrations); in tests it is the test database of the primary.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+# Aliases of DATABASES reads are sent to (one at random per query), e.g. ['replica'].
+# Empty: everything uses 'default'.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['educa.db.ReplicaRouter']
+# After writing, a user reads from the primary for this long (longer than the replication lag).
+REPLICA_PIN_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -144,6 +174,27 @@ STATIC_URL = 'static/'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Resumable uploads (courses.models.UploadSession): where the chunks are assembled, the maximum
+# size of a chunk and of a file, and how long an unfinished upload is kept.
+UPLOAD_SESSIONS_DIR = BASE_DIR / 'upload_sessions'
+UPLOAD_CHUNK_MAX_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+UPLOAD_SESSION_MAX_AGE = 60 * 60 * 24
+# Per user: unfinished uploads at the same time, and their total announced size (disk space
+# reserved in UPLOAD_SESSIONS_DIR).
+UPLOAD_MAX_OPEN_SESSIONS = 5
+UPLOAD_MAX_OPEN_SIZE = 4 * 1024 * 1024 * 1024
+
+# Responsive versions of the Image contents (courses/derivatives.py): widths, and number of
+# background threads generating them (0 disables the generation).
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 1280)
+IMAGE_DERIVATIVE_WORKERS = 2
+
+# django-embed-video: videos are resolved once on save (courses.models.Video.refresh_embed()).
+# YouTube's hqdefault.jpg thumbnail always exists: no HEAD requests to find a bigger one.
+EMBED_VIDEO_YOUTUBE_CHECK_THUMBNAIL = False
+EMBED_VIDEO_TIMEOUT = 5
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -165,12 +216,35 @@ LOGIN_REDIRECT_URL = reverse_lazy('student_course_list')
 # The Memcached is replaced by Redis.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-        'LOCATION': 'redis://redis:6379/1'
+        # Redis, with a per-process copy of the hot keys in front of it (educa/cache.py)
+        'BACKEND': 'educa.cache.TwoTierRedisCache',
+        'LOCATION': 'redis://redis:6379/1',
         # Connect to the Redis service on port 6379 and use the database no. 1 for caching.
+        'OPTIONS': {
+            # catalog entries and rendered fragments of the student pages (read-only values)
+            'LOCAL_PREFIXES': ['all_subjects', 'all_courses', 'subject_', 'template.cache.'],
+            'LOCAL_MAX_ENTRIES': 500,
+            'LOCAL_TIMEOUT': 60,    # seconds
+        },
     }
 }
 
+# Catalog entries ('all_subjects', 'all_courses', 'subject_<id>_courses') are invalidated on
+# write through versioned keys (courses/caching.py), so they can live for hours.
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Shared fragments of the student course pages (module navigation and contents), keyed on the
+# version of the course structure / module contents, so they are invalidated on write too.
+COURSE_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Cache warming ('manage.py warm_cache', courses/catalog.py). With CACHE_WARMUP_ON_MIGRATE,
+# 'migrate' (run when the container starts) also warms the cache.
+CACHE_WARMUP_ON_MIGRATE = False
+CACHE_WARMUP_WORKERS = 4
+
+# Full-text search of courses, modules and texts (see courses/search.py)
+SEARCH_BACKEND = 'courses.search.SQLiteFTSBackend'
+
 
 # Configuration of Debug_toolbar with Docker
 INTERNAL_IPS = ['127.0.0.1', 'localhost']
@@ -20,6 +20,7 @@ from django.contrib import admin
 from django.contrib.auth import views as auth_views
 from django.urls import include, path
 from courses.views import CourseListView
+from educa.metrics import metrics_view
 
 urlpatterns = [
     path('accounts/login/', auth_views.LoginView.as_view(), name='login'),
@@ -30,6 +31,7 @@ urlpatterns = [
     path('students/', include('students.urls')),
     path('__debug__/', include('debug_toolbar.urls')),
     path('api/', include('courses.api.urls', namespace='api')),
+    path('metrics/', metrics_view, name='metrics'),
 
 ]
 
@@ -1,3 +1,86 @@
-from django.test import TestCase
+import json
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from courses.models import Content, Course, Module, Subject, Text, Video
 
-# Create your tests here.
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StudentCourseDetailCacheTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('instructor', password='password')
+        subject = Subject.objects.create(title='Subject', slug='subject')
+        self.course = Course.objects.create(
+            owner=self.owner, subject=subject, title='Course', slug='course', overview='Overview'
+        )
+        self.first = Module.objects.create(course=self.course, title='First module')
+        self.second = Module.objects.create(course=self.course, title='Second module')
+        self.students = [User.objects.create_user(f'student{i}', password='password') for i in range(2)]
+        self.course.students.add(*self.students)
+        self.url = reverse('student_course_detail', args=[self.course.pk])
+
+    def get(self, user, url=None):
+        self.client.force_login(user)
+        response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_pages_are_not_shared_between_users(self):
+        first = self.get(self.students[0])
+        second = self.get(self.students[1])
+        self.assertNotEqual(first.context['csrf_token'], second.context['csrf_token'])
+        self.assertContains(second, str(second.context['csrf_token']))
+
+        outsider = User.objects.create_user('outsider', password='password')
+        self.client.force_login(outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_module_navigation_is_invalidated_on_write(self):
+        self.get(self.students[0])
+        Module.objects.create(course=self.course, title='Third module')
+        self.assertContains(self.get(self.students[1]), 'Third module')
+
+        self.client.force_login(self.owner)
+        self.client.post(
+            reverse('module_order'),
+            json.dumps({self.first.pk: 1, self.second.pk: 0, self.course.modules.last().pk: 2}),
+            content_type='application/json'
+        )
+        content = self.get(self.students[0]).content.decode()
+        self.assertLess(content.index('Second module'), content.index('First module'))
+
+    def test_module_contents_are_invalidated_on_write(self):
+        url = reverse('student_course_detail_module', args=[self.course.pk, self.first.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            text = Text.objects.create(owner=self.owner, title='Text', content='Old content')
+            first = Content.objects.create(module=self.first, item=text)
+            video = Video.objects.create(owner=self.owner, title='Video', url='https://example.com/v')
+            second = Content.objects.create(module=self.first, item=video)
+        self.assertContains(self.get(self.students[0], url), 'Old content')
+
+        # item edited (ContentCreateUpdateView saves the item)
+        with self.captureOnCommitCallbacks(execute=True):
+            text.content = 'New content'
+            text.save()
+        self.assertContains(self.get(self.students[1], url), 'New content')
+
+        # contents reordered
+        self.client.force_login(self.owner)
+        self.client.post(
+            reverse('content_order'),
+            json.dumps({second.pk: 0, first.pk: 1}),
+            content_type='application/json'
+        )
+        content = self.get(self.students[0], url).content.decode()
+        self.assertLess(content.index('Video'), content.index('New content'))
+
+        # content deleted (ContentDeleteView)
+        self.client.force_login(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('module_content_delete', args=[second.pk]))
+        self.assertNotContains(self.get(self.students[0], url), '<h2>Video</h2>')
@@ -1,6 +1,5 @@
 from django.urls import path
 from . import views
-from django.views.decorators.cache import cache_page    # for caching
 
 
 
@@ -14,16 +13,17 @@ urlpatterns = [
     path(
         'courses/', views.StudentCourseListView.as_view(), name='student_course_list'
     ),
-    # Different URL = Different cache entry, even if the same view processes it.
-    # Each different URL gets its own separate cache, even if they use the same view.
+    # Not wrapped in cache_page(): it keys on the URL only, so the page of the first student
+    # (header, CSRF token) was served to everyone and was never invalidated. The shared parts
+    # of the page are cached as template fragments instead (see StudentCourseDetailView).
     path(
         'course/<pk>/',
-        cache_page(60 * 15)(views.StudentCourseDetailView.as_view()),
+        views.StudentCourseDetailView.as_view(),
         name='student_course_detail'
     ),
     path(
         'course/<pk>/<module_id>/',
-        cache_page(60 * 15)(views.StudentCourseDetailView.as_view()),
+        views.StudentCourseDetailView.as_view(),
         name='student_course_detail_module'
     ),
 ]
\ No newline at end of file
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.forms import UserCreationForm
 from django.urls import reverse_lazy
@@ -6,7 +7,9 @@ from django.views.generic.list import ListView
 from django.views.generic.detail import DetailView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from .forms import CourseEnrollForm
+from courses.caching import course_structure_family, get_versions, module_contents_family
 from courses.models import Course
+from educa.db import PRIMARY
 
 
 
@@ -121,6 +124,25 @@ class StudentCourseDetailView(LoginRequiredMixin, DetailView):
             # get first module
             context['module'] = course.modules.first()
 
+        module = context['module']
+        # Lazy queryset: it only hits the database when the 'module_contents' fragment
+        # is not cached, and then resolves all the items with one query per item model.
+        # Cached for hours, so read from the primary database (see educa/db.py).
+        context['contents'] = module.contents.using(PRIMARY).with_items() if module else []
+        context['modules'] = course.modules.using(PRIMARY)
+
+        # Caching of the page:
+        # - per user, never cached: the enrollment check (get_queryset), the header and CSRF token.
+        # - shared by all the students: the module navigation, cached per course structure
+        #   version (bumped when modules are added, changed, deleted or reordered), and the
+        #   contents of the module, cached per module contents version (bumped when contents
+        #   or their items are added, changed, deleted or reordered).
+        structure = course_structure_family(course.id)
+        contents = module_contents_family(module.id) if module else None
+        versions = get_versions(*filter(None, [structure, contents]))
+        context['structure_version'] = versions[structure]
+        context['contents_version'] = versions.get(contents)
+        context['cache_timeout'] = settings.COURSE_CACHE_TIMEOUT
         return context
         # The Flow:
 #     DetailView.get()